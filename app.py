@@ -1,83 +1,101 @@
 # app.py
 
-from flask import Flask, render_template, redirect, url_for, request, flash
+from flask import (Flask, Blueprint, render_template, redirect, url_for, request, flash, jsonify, abort,
+                   make_response, get_flashed_messages, session, stream_template, stream_with_context)
+from markupsafe import Markup
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user, UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta, date
 from flask_wtf import FlaskForm
+from flask_wtf.csrf import generate_csrf, validate_csrf
 from wtforms import (StringField, PasswordField, SubmitField, IntegerField,
                      SelectField, TextAreaField, BooleanField, DateField, HiddenField)
-from wtforms.validators import DataRequired, EqualTo, Length, Optional
+from wtforms.validators import DataRequired, EqualTo, Length, Optional, ValidationError
+from werkzeug.datastructures import MultiDict
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from psycopg2 import sql, IntegrityError
+import time
+import hashlib
+import click
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from psycopg2 import sql, IntegrityError, DataError
+from psycopg2.extras import execute_values
+import db
+from db import get_db
+import hashing
+from hashing import HasherBusy
+import metrics
+import transfer
+import schema
+import assets
+from cache import TTLCache
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'secret')  # Replace with a secure key
 
+# Per-worker connection pool; one connection is borrowed per request and
+# returned on app context teardown
+db.init_app(app)
+
+# Opt-in request timing (METRICS_ENABLED); must be set up before the pool
+# is first used so connections get the instrumented cursor
+metrics.init_app(app)
+
+# Password hashing runs on a bounded process pool so slow PBKDF2 rounds
+# don't stall the web worker
+password_hasher = hashing.init_app(app)
+
+# Fingerprinted, precompressed static files once `flask build-assets` has
+# run. Image variants are sized for how the templates display them.
+app.config['ASSET_IMAGE_WIDTHS'] = {
+    'images/Subject.png': (40, 80, 120),          # navbar logo, 40px tall
+    'images/eatMyLunch.webp': (480, 760, 1520),   # dashboard, up to 760px wide
+}
+assets.init_app(app)
+
 # Initialize Flask-Login
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
-def get_db_connection():
-    conn = psycopg2.connect(
-        os.environ['DATABASE_URL'],
-        cursor_factory=RealDictCursor  # Use RealDictCursor for dictionary-like row access
-    )
-    return conn
-
-def init_db():
-    conn = get_db_connection()
-    with conn.cursor() as cur:
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id SERIAL PRIMARY KEY,
-                username VARCHAR(150) NOT NULL UNIQUE,
-                password VARCHAR(255) NOT NULL
-            );
-            CREATE TABLE IF NOT EXISTS habits (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER NOT NULL REFERENCES users(id),
-                name VARCHAR(150) NOT NULL,
-                frequency INTEGER NOT NULL,
-                period VARCHAR(20) NOT NULL,
-                times_completed INTEGER DEFAULT 0
-            );
-            CREATE TABLE IF NOT EXISTS tasks (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER NOT NULL REFERENCES users(id),
-                habit_id INTEGER REFERENCES habits(id),
-                name VARCHAR(150) NOT NULL,
-                description TEXT,
-                date DATE,
-                completed BOOLEAN DEFAULT FALSE
-            );
-        ''')
-        conn.commit()
-    conn.close()
+# Lets templates hand the CSRF token to scripts.js for API calls
+app.jinja_env.globals['csrf_token'] = generate_csrf
+
+# The schema is managed by migrations/ (see schema.py). Apply them with
+# `flask migrate`; gunicorn.conf.py also runs them once in the master, so
+# importing this module never touches the database.
 
-# Call init_db() when the app starts
-init_db()
+# Column lists for the list views, so pages never pull more than they render
+HABIT_COLUMNS = 'id, user_id, name, frequency, period, times_completed'
+TASK_COLUMNS = 'id, user_id, habit_id, name, description, date, completed'
 
-# User model for Flask-Login
+# User model for Flask-Login (the password hash is deliberately not kept)
 class User(UserMixin):
     def __init__(self, user_row):
         self.id = user_row['id']
         self.username = user_row['username']
-        self.password = user_row['password']
+
+# Per-worker cache of logged-in users so @login_required doesn't hit the database
+user_cache = TTLCache(maxsize=int(os.environ.get('USER_CACHE_SIZE', 1024)),
+                      ttl=float(os.environ.get('USER_CACHE_TTL', 300)))
 
 # User loader callback
 @login_manager.user_loader
 def load_user(user_id):
-    conn = get_db_connection()
-    with conn.cursor() as cursor:
-        cursor.execute('SELECT * FROM users WHERE id = %s', (user_id,))
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+    conn = get_db()
+    with metrics.timed('load-user'), conn.cursor() as cursor:
+        cursor.execute('SELECT id, username FROM users WHERE id = %s', (user_id,))
         user_row = cursor.fetchone()
-    conn.close()
     if user_row:
-        return User(user_row)
+        user = User(user_row)
+        user_cache.set(user.id, user)
+        return user
     else:
         return None
 
@@ -108,6 +126,82 @@ class TaskForm(FlaskForm):
     habit_id = HiddenField('Habit ID', validators=[Optional()])
     submit = SubmitField('Add Task')
 
+# Conditional GET and fragment caching for the habits and tasks pages.
+# Every habit/task write bumps users.data_version, so (user, version) names
+# an immutable snapshot of the user's data across all workers.
+fragment_cache = TTLCache(maxsize=int(os.environ.get('FRAGMENT_CACHE_SIZE', 4096)),
+                          ttl=float(os.environ.get('FRAGMENT_CACHE_TTL', 600)),
+                          weigh=len,
+                          maxweight=int(os.environ.get('FRAGMENT_CACHE_MAX_CHARS', 16 * 1024 * 1024)))
+
+def templates_digest():
+    digest = hashlib.sha256()
+    for root, dirs, files in sorted(os.walk(os.path.join(app.root_path, app.template_folder))):
+        dirs.sort()
+        for name in sorted(files):
+            with open(os.path.join(root, name), 'rb') as f:
+                digest.update(f.read())
+    # Pages embed fingerprinted asset URLs, so a new asset build changes them too
+    if os.path.exists(assets.manifest_path(app.static_folder)):
+        with open(assets.manifest_path(app.static_folder), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+# Changes whenever the templates or built assets do, so a deploy
+# invalidates old ETags
+TEMPLATES_DIGEST = templates_digest()
+
+def data_version(conn, user_id):
+    with conn.cursor() as cursor:
+        cursor.execute('SELECT data_version FROM users WHERE id = %s', (user_id,))
+        row = cursor.fetchone()
+    return row['data_version'] if row else 0
+
+def bump_data_version(conn, user_id):
+    """Mark the user's habits/tasks as changed; call before committing a write."""
+    with conn.cursor() as cursor:
+        cursor.execute('UPDATE users SET data_version = data_version + 1 WHERE id = %s', (user_id,))
+
+def page_etag(version):
+    """Strong ETag for the current GET, or None if flash messages are pending."""
+    # Peek rather than get_flashed_messages(), which would hide later flashes
+    if session.get('_flashes'):
+        return None
+    # Pages embed a CSRF token, so a cached copy must not outlive half its lifetime
+    time_limit = app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    token_epoch = int(time.time() // (time_limit / 2)) if time_limit else 0
+    # ...and must not be reused by a new session, whose token differs
+    csrf_token = session.get(app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token'), '')
+    raw = '%s:%s:%s:%s:%s:%s:%s' % (current_user.id, version, date.today(), request.full_path,
+                                    token_epoch, csrf_token, TEMPLATES_DIGEST)
+    return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+def not_modified(etag):
+    """A 304 response if the client already has this version of the page."""
+    if etag and request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return None
+
+def conditional_page(body, etag):
+    response = make_response(body)
+    # The page may have rendered flashes added while building it
+    if etag and not get_flashed_messages():
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    else:
+        response.headers['Cache-Control'] = 'no-store'
+    return response
+
+def cached_fragment(key, render):
+    html = fragment_cache.get(key)
+    if html is None:
+        html = Markup(render())
+        fragment_cache.set(key, html)
+    return html
+
 # Route: Home (Redirect to Dashboard or Login)
 @app.route('/')
 def home():
@@ -116,18 +210,30 @@ def home():
     else:
         return redirect(url_for('login'))
 
+def hashing_busy(template, form):
+    """Fast 429 for when the password hashing queue is full."""
+    flash('The server is busy right now. Please try again in a moment.', 'danger')
+    response = make_response(render_template(template, form=form), 429)
+    response.headers['Retry-After'] = '1'
+    return response
+
 # Route: Register
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     form = RegisterForm()
     if form.validate_on_submit():
-        conn = get_db_connection()
-        hashed_password = generate_password_hash(form.password.data, method='pbkdf2:sha256')
+        try:
+            hashed_password = password_hasher.hash(form.password.data)
+        except HasherBusy:
+            return hashing_busy('register.html', form)
+        conn = get_db()
         try:
             with conn.cursor() as cursor:
-                cursor.execute('INSERT INTO users (username, password) VALUES (%s, %s)',
+                cursor.execute('INSERT INTO users (username, password) VALUES (%s, %s) RETURNING id',
                                (form.username.data, hashed_password))
+                new_id = cursor.fetchone()['id']
             conn.commit()
+            user_cache.pop(new_id)
             flash('Registration successful. Please log in.', 'success')
             return redirect(url_for('login'))
         except IntegrityError as e:
@@ -136,8 +242,6 @@ def register():
                 flash('Username already exists. Please choose a different one.', 'danger')
             else:
                 flash('An error occurred during registration.', 'danger')
-        finally:
-            conn.close()
     return render_template('register.html', form=form)
 
 # Route: Login
@@ -145,13 +249,29 @@ def register():
 def login():
     form = LoginForm()
     if form.validate_on_submit():
-        conn = get_db_connection()
+        conn = get_db()
         with conn.cursor() as cursor:
-            cursor.execute('SELECT * FROM users WHERE username = %s', (form.username.data,))
+            cursor.execute('SELECT id, username, password FROM users WHERE username = %s',
+                           (form.username.data,))
             user_row = cursor.fetchone()
-        conn.close()
-        if user_row and check_password_hash(user_row['password'], form.password.data):
+        try:
+            valid = user_row is not None and password_hasher.verify(user_row['password'], form.password.data)
+        except HasherBusy:
+            return hashing_busy('login.html', form)
+        if valid:
+            # Upgrade hashes made with an older method or work factor
+            if password_hasher.needs_rehash(user_row['password']):
+                try:
+                    new_hash = password_hasher.hash(form.password.data)
+                except HasherBusy:
+                    pass  # Try again on the next login
+                else:
+                    with conn.cursor() as cursor:
+                        cursor.execute('UPDATE users SET password = %s WHERE id = %s',
+                                       (new_hash, user_row['id']))
+                    conn.commit()
             user = User(user_row)
+            user_cache.set(user.id, user)
             login_user(user)
             flash('Logged in successfully.', 'success')
             return redirect(url_for('dashboard'))
@@ -163,6 +283,7 @@ def login():
 @app.route('/logout')
 @login_required
 def logout():
+    user_cache.pop(current_user.id)
     logout_user()
     flash('You have been logged out.', 'info')
     return redirect(url_for('login'))
@@ -178,7 +299,7 @@ def dashboard():
 @login_required
 def habits():
     form = HabitForm()
-    conn = get_db_connection()
+    conn = get_db()
     editing_habit = None
 
     # Handle form submission
@@ -188,10 +309,17 @@ def habits():
             if form.validate_on_submit():
                 with conn.cursor() as cursor:
                     cursor.execute('''
-                        UPDATE habits
+                        UPDATE habits h
                         SET name = %s, frequency = %s, period = %s
-                        WHERE id = %s AND user_id = %s
+                        FROM (SELECT id, period FROM habits WHERE id = %s AND user_id = %s FOR UPDATE) old
+                        WHERE h.id = old.id
+                        RETURNING old.period AS old_period, h.period
                     ''', (form.name.data, form.frequency.data, form.period.data, habit_id, current_user.id))
+                    updated = cursor.fetchone()
+                # Progress is bucketed by period, so a new period needs new buckets
+                if updated and updated['old_period'] != updated['period']:
+                    rebuild_habit_progress(conn, [int(habit_id)])
+                bump_data_version(conn, current_user.id)
                 conn.commit()
                 flash('Habit updated successfully.', 'success')
                 return redirect(url_for('habits'))
@@ -202,15 +330,23 @@ def habits():
                         INSERT INTO habits (user_id, name, frequency, period, times_completed)
                         VALUES (%s, %s, %s, %s, 0)
                     ''', (current_user.id, form.name.data, form.frequency.data, form.period.data))
+                bump_data_version(conn, current_user.id)
                 conn.commit()
                 flash('Habit added successfully.', 'success')
                 return redirect(url_for('habits'))
 
+    version = data_version(conn, current_user.id)
+    etag = page_etag(version) if request.method == 'GET' else None
+    response = not_modified(etag)
+    if response:
+        return response
+
     # Handle editing habit
     edit_habit_id = request.args.get('edit')
     if edit_habit_id:
         with conn.cursor() as cursor:
-            cursor.execute('SELECT * FROM habits WHERE id = %s AND user_id = %s', (edit_habit_id, current_user.id))
+            cursor.execute('SELECT ' + HABIT_COLUMNS + ' FROM habits WHERE id = %s AND user_id = %s',
+                           (edit_habit_id, current_user.id))
             editing_habit = cursor.fetchone()
         if editing_habit:
             form.name.data = editing_habit['name']
@@ -219,71 +355,185 @@ def habits():
         else:
             flash('Habit not found.', 'danger')
 
-    with conn.cursor() as cursor:
-        cursor.execute('SELECT * FROM habits WHERE user_id = %s', (current_user.id,))
-        habits = cursor.fetchall()
-    conn.close()
-    return render_template('habits.html', form=form, habits=habits, editing_habit=editing_habit)
+    today = date.today()
+    habit_rows_html = cached_fragment(
+        ('habit_rows', current_user.id, version, today),
+        lambda: render_template('partials/habit_rows.html',
+                                habits=habit_progress(conn, current_user.id, today=today)))
+    return conditional_page(render_template('habits.html', form=form, habit_rows_html=habit_rows_html,
+                                            editing_habit=editing_habit), etag)
 
 # Route: Delete Habit
 @app.route('/delete_habit/<int:habit_id>', methods=['POST'])
 @login_required
 def delete_habit(habit_id):
-    conn = get_db_connection()
+    conn = get_db()
     with conn.cursor() as cursor:
+        # Drop the tasks the scheduler created for this habit that are still
+        # to do, and keep the rest, unlinked, as plain tasks
+        cursor.execute('''
+            DELETE FROM tasks t
+            USING habit_occurrences o JOIN habits h ON h.id = o.habit_id
+            WHERE o.task_id = t.id AND t.habit_id = h.id AND h.id = %s AND h.user_id = %s
+              AND t.completed IS NOT TRUE AND t.date >= %s
+        ''', (habit_id, current_user.id, date.today()))
+        cursor.execute('''
+            UPDATE tasks t SET habit_id = NULL
+            FROM habits h
+            WHERE t.habit_id = h.id AND h.id = %s AND h.user_id = %s
+        ''', (habit_id, current_user.id))
         cursor.execute('DELETE FROM habits WHERE id = %s AND user_id = %s', (habit_id, current_user.id))
+    bump_data_version(conn, current_user.id)
     conn.commit()
-    conn.close()
     flash('Habit deleted successfully.', 'success')
     return redirect(url_for('habits'))
 
+# Tasks page views. Every view is a run of consecutive dates; view_args are
+# the query args that reproduce it, carried through the page's links and forms.
+MAX_RANGE_DAYS = 366
+UNDATED_PAGE_SIZE = int(os.environ.get('UNDATED_PAGE_SIZE', 50))
+DAY_CARD_FETCH_SIZE = 500
+
+def parse_view_date(value):
+    try:
+        return datetime.strptime(value or '', '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError('Dates must be given as YYYY-MM-DD.')
+
+def view_dates(view_type, today, start=None, end=None):
+    """Dates shown by a view, plus its view_args.
+
+    Raises ValueError for a bad view, or OverflowError for one running off
+    the end of the calendar.
+    """
+    view_args = {'view': view_type}
+    if view_type == 'day':
+        first = last = today
+    elif view_type == '3day':
+        first, last = today, today + timedelta(days=2)
+    elif view_type == 'week':
+        # Start from Sunday
+        first = today - timedelta(days=(today.weekday() + 1) % 7)
+        last = first + timedelta(days=6)
+    elif view_type == 'month':
+        first = (parse_view_date(start) if start else today).replace(day=1)
+        last = (first + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        if start:
+            view_args['start'] = first.isoformat()
+    elif view_type == 'range':
+        first, last = parse_view_date(start), parse_view_date(end)
+        if last < first:
+            raise ValueError('The end date must not be before the start date.')
+        if (last - first).days >= MAX_RANGE_DAYS:
+            raise ValueError('Date ranges are limited to %d days.' % MAX_RANGE_DAYS)
+        view_args.update(start=first.isoformat(), end=last.isoformat())
+    else:
+        raise ValueError('Unknown view.')
+    return [first + timedelta(days=i) for i in range((last - first).days + 1)], view_args
+
+def view_navigation(view_args, dates):
+    """view_args for the previous and next month or range, or None for fixed views."""
+    if view_args['view'] == 'month':
+        prev_month = (dates[0] - timedelta(days=1)).replace(day=1)
+        next_month = dates[-1] + timedelta(days=1)
+        return ({'view': 'month', 'start': prev_month.isoformat()},
+                {'view': 'month', 'start': next_month.isoformat()})
+    if view_args['view'] == 'range':
+        span = timedelta(days=len(dates))
+        return tuple({'view': 'range', 'start': (dates[0] + shift).isoformat(),
+                      'end': (dates[-1] + shift).isoformat()} for shift in (-span, span))
+    return None
+
+def iter_day_cards(conn, user_id, version, dates, view_args, today):
+    """Yield (date, card html) for each of dates, in order.
+
+    Cards missing from the fragment cache are rendered as their tasks arrive
+    from a server-side cursor, so a long range never holds all of its rows or
+    cards in memory at once.
+    """
+    view_key = tuple(sorted(view_args.items()))
+    keys = {d: ('day_card', user_id, version, d, view_key, d == today) for d in dates}
+    cached = {d: fragment_cache.get(key) for d, key in keys.items()}
+    missing = [d for d in dates if cached[d] is None]
+    if not missing:
+        for d in dates:
+            yield d, cached[d]
+        return
+
+    with conn.cursor(name='day_cards') as cursor:
+        cursor.itersize = DAY_CARD_FETCH_SIZE
+        cursor.execute('''
+            SELECT ''' + TASK_COLUMNS + ''' FROM tasks
+            WHERE user_id = %s AND date BETWEEN %s AND %s
+            ORDER BY date, id
+        ''', (user_id, missing[0], missing[-1]))
+        rows = iter(cursor)
+        row = next(rows, None)
+        for d in dates:
+            day_tasks = []
+            while row is not None and row['date'] <= d:
+                if row['date'] == d:
+                    day_tasks.append(row)
+                row = next(rows, None)
+            html = cached[d]
+            if html is None:
+                html = Markup(render_template('partials/day_card.html', date_obj=d, day_tasks=day_tasks,
+                                              view_args=view_args, today=today))
+                fragment_cache.set(keys[d], html)
+            yield d, html
+
+def buffered(chunks, size=8192):
+    """Join a template stream's many small chunks into fewer, larger writes."""
+    parts, length = [], 0
+    for chunk in chunks:
+        parts.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(parts)
+            parts, length = [], 0
+    if parts:
+        yield ''.join(parts)
+
 @app.route('/tasks', methods=['GET', 'POST'])
 @login_required
 def tasks():
     task_form = TaskForm()
-    conn = get_db_connection()
+    conn = get_db()
     editing_task = None
 
     # Determine the current view
     view_type = request.args.get('view', 'day')
     today = date.today()
-    dates = []
+    try:
+        dates, view_args = view_dates(view_type, today, request.args.get('start'), request.args.get('end'))
+        nav_args = view_navigation(view_args, dates)
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('tasks'))
+    except OverflowError:
+        # A view at the edge of the calendar, or the one before or after it, isn't representable
+        flash('Dates must be between 0001-01-01 and 9999-12-31.', 'danger')
+        return redirect(url_for('tasks'))
 
-    if view_type == 'day':
-        dates.append(today)
-    elif view_type == '3day':
-        for i in range(3):
-            dates.append(today + timedelta(days=i))
-    elif view_type == 'week':
-        # Start from Sunday
-        start_day = today - timedelta(days=today.weekday() + 1 if today.weekday() != 6 else 0)
-        for i in range(7):
-            dates.append(start_day + timedelta(days=i))
+    # Undated tasks are paged by id (keyset), so deep pages cost the same as the first
+    after = request.args.get('after', 0, type=int)
+    page_args = dict(view_args, after=after) if after else view_args
 
     # Handle form submission
     if request.method == 'POST':
         task_id = request.form.get('task_id')
-        habit_id = task_form.habit_id.data or None
-        habit_id = int(habit_id) if habit_id else None
+        try:
+            habit_id = owned_habit_id(conn, task_form.habit_id.data, current_user.id)
+        except ValueError as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('tasks', **page_args))
 
         if task_id:  # Update existing task
             if task_form.validate_on_submit():
-                with conn.cursor() as cursor:
-                    cursor.execute('''
-                        UPDATE tasks
-                        SET habit_id = %s, name = %s, description = %s, date = %s
-                        WHERE id = %s AND user_id = %s
-                    ''', (
-                        habit_id,
-                        task_form.name.data,
-                        task_form.description.data,
-                        task_form.date.data.isoformat() if task_form.date.data else None,
-                        task_id,
-                        current_user.id
-                    ))
-                conn.commit()
+                update_task(conn, task_id, current_user.id, habit_id, task_form.name.data,
+                            task_form.description.data, task_form.date.data)
                 flash('Task updated successfully.', 'success')
-                return redirect(url_for('tasks', view=view_type))
+                return redirect(url_for('tasks', **page_args))
         else:  # Add new task
             if task_form.validate_on_submit():
                 with conn.cursor() as cursor:
@@ -297,9 +547,16 @@ def tasks():
                         task_form.description.data,
                         task_form.date.data.isoformat() if task_form.date.data else None
                     ))
+                bump_data_version(conn, current_user.id)
                 conn.commit()
                 flash('Task added successfully.', 'success')
-                return redirect(url_for('tasks', view=view_type))
+                return redirect(url_for('tasks', **page_args))
+
+    version = data_version(conn, current_user.id)
+    etag = page_etag(version) if request.method == 'GET' else None
+    response = not_modified(etag)
+    if response:
+        return response
 
     # Handle editing task
     edit_task_id = request.args.get('edit')
@@ -315,81 +572,1013 @@ def tasks():
         else:
             flash('Task not found.', 'danger')
 
-    # Retrieve habits and tasks
-    with conn.cursor() as cursor:
-        cursor.execute('SELECT * FROM habits WHERE user_id = %s', (current_user.id,))
-        habits = cursor.fetchall()
+    # Habits list and day cards come from the fragment cache when this
+    # version has been rendered before; only missing days are queried
+    habits_html = cached_fragment(
+        ('habits_list', current_user.id, version, today),
+        lambda: render_template('partials/habits_list.html',
+                                habits=habit_progress(conn, current_user.id, today=today)))
 
+    with conn.cursor() as cursor:
         cursor.execute('''
-            SELECT * FROM tasks
-            WHERE user_id = %s AND date IS NULL
-        ''', (current_user.id,))
+            SELECT ''' + TASK_COLUMNS + ''' FROM tasks
+            WHERE user_id = %s AND date IS NULL AND id > %s
+            ORDER BY id
+            LIMIT %s
+        ''', (current_user.id, after, UNDATED_PAGE_SIZE + 1))
         undated_tasks = cursor.fetchall()
+    next_after = None
+    if len(undated_tasks) > UNDATED_PAGE_SIZE:
+        undated_tasks = undated_tasks[:UNDATED_PAGE_SIZE]
+        next_after = undated_tasks[-1]['id']
 
-        cursor.execute('''
-            SELECT * FROM tasks
-            WHERE user_id = %s AND date IS NOT NULL
-        ''', (current_user.id,))
-        dated_tasks = cursor.fetchall()
-
-    # Prepare tasks by date
-    tasks_by_date = {d.strftime('%Y-%m-%d'): [] for d in dates}
+    # The session is saved before a streamed body is generated, so pop the
+    # flashes and create the CSRF token now rather than mid-render
+    get_flashed_messages()
+    generate_csrf()
 
-    for task in dated_tasks:
-        task_date_str = task['date'].strftime('%Y-%m-%d')
-        if task_date_str in tasks_by_date:
-            tasks_by_date[task_date_str].append(task)
-
-    conn.close()
-
-    return render_template('tasks.html', task_form=task_form, habits=habits,
-                           undated_tasks=undated_tasks, tasks_by_date=tasks_by_date,
-                           dates=dates, view_type=view_type, editing_task=editing_task, today=today)
+    day_cards = iter_day_cards(conn, current_user.id, version, dates, view_args, today)
+    body = buffered(stream_template('tasks.html', task_form=task_form, habits_html=habits_html,
+                                    undated_tasks=undated_tasks, next_after=next_after, after=after,
+                                    day_cards=day_cards, view_args=view_args,
+                                    page_args=page_args, nav_args=nav_args, first_date=dates[0],
+                                    last_date=dates[-1], editing_task=editing_task, today=today))
+    return conditional_page(body, etag)
 
 # Route: Delete Task
 @app.route('/delete_task/<int:task_id>', methods=['POST'])
 @login_required
 def delete_task(task_id):
-    conn = get_db_connection()
-    with conn.cursor() as cursor:
-        cursor.execute('DELETE FROM tasks WHERE id = %s AND user_id = %s', (task_id, current_user.id))
-    conn.commit()
-    conn.close()
+    delete_task_row(get_db(), task_id, current_user.id)
     flash('Task deleted successfully.', 'success')
     return redirect(url_for('tasks'))
 
+# Habit progress: habit_completions holds one row per habit per period
+# (bucketed by PERIOD_START on the habit's period) counting completed tasks,
+# keyed by the task's date or, for undated tasks, the day it was completed.
+# Writes keep it in step so pages read O(habits) rows instead of scanning tasks.
+
+# First day of the period containing {day}. Weeks run Sunday to Saturday like
+# the tasks page's Week view, rather than date_trunc's Monday-based ISO weeks.
+_WEEK_SHIFT = "CASE WHEN {period} = 'week' THEN interval '1 day' ELSE interval '0' END"
+PERIOD_START = "(date_trunc({period}, ({day})::timestamp + " + _WEEK_SHIFT + ") - " + _WEEK_SHIFT + ")::date"
+PERIOD_BUCKET = PERIOD_START.replace('{day}', 'COALESCE({task}.date, {task}.completed_on)')
+
+def habit_progress(conn, user_id, habit_ids=None, today=None):
+    """Return the user's habits with current-period progress and streaks.
+
+    Each row carries period_start, period_completed (tasks completed in the
+    current period) and streak (consecutive periods, ending with the current
+    or the previous one, in which the habit's frequency was met).
+    """
+    today = today or date.today()
+    current = PERIOD_START.format(period='h.period', day='%(today)s')
+    with conn.cursor() as cursor:
+        cursor.execute('''
+            WITH met AS (
+                SELECT hc.habit_id, hc.period_start, h.period,
+                       row_number() OVER w AS rn,
+                       max(hc.period_start) OVER w AS latest
+                FROM habit_completions hc
+                JOIN habits h ON h.id = hc.habit_id
+                WHERE h.user_id = %(user_id)s
+                  AND hc.completed >= h.frequency
+                  AND hc.period_start <= ''' + current + '''
+                WINDOW w AS (PARTITION BY hc.habit_id ORDER BY hc.period_start DESC)
+            ), streaks AS (
+                SELECT habit_id, count(*) AS streak
+                FROM met
+                WHERE latest >= ''' + PERIOD_START.format(period='period', day='%(today)s') + '''
+                                 - ('1 ' || period)::interval
+                  AND period_start = latest - (rn - 1) * ('1 ' || period)::interval
+                GROUP BY habit_id
+            )
+            SELECT h.id, h.user_id, h.name, h.frequency, h.period, h.times_completed,
+                   ''' + current + ''' AS period_start,
+                   COALESCE(hc.completed, 0) AS period_completed,
+                   COALESCE(s.streak, 0) AS streak
+            FROM habits h
+            LEFT JOIN habit_completions hc
+                ON hc.habit_id = h.id AND hc.period_start = ''' + current + '''
+            LEFT JOIN streaks s ON s.habit_id = h.id
+            WHERE h.user_id = %(user_id)s
+              AND (%(all)s OR h.id = ANY(%(habit_ids)s))
+            ORDER BY h.id
+        ''', {'user_id': user_id, 'today': today, 'all': habit_ids is None,
+              'habit_ids': list(habit_ids or [])})
+        return cursor.fetchall()
+
+def rebuild_habit_progress(conn, habit_ids):
+    """Recompute habit_completions for the given habits from their tasks.
+
+    Used when buckets can't be adjusted incrementally (a habit's period
+    changed, or a completed task moved between habits or dates) and by the
+    backfill command. The caller commits.
+    """
+    habit_ids = list(habit_ids)
+    with conn.cursor() as cursor:
+        # Tasks completed before completed_on existed count on their own date,
+        # or today if undated
+        cursor.execute('''
+            UPDATE tasks SET completed_on = COALESCE(date, %s)
+            WHERE habit_id = ANY(%s) AND completed AND completed_on IS NULL
+        ''', (date.today(), habit_ids))
+        cursor.execute('DELETE FROM habit_completions WHERE habit_id = ANY(%s)', (habit_ids,))
+        cursor.execute('''
+            UPDATE users SET data_version = data_version + 1
+            WHERE id IN (SELECT user_id FROM habits WHERE id = ANY(%s))
+        ''', (habit_ids,))
+        cursor.execute('''
+            INSERT INTO habit_completions (habit_id, period_start, completed)
+            SELECT h.id, ''' + PERIOD_BUCKET.format(period='h.period', task='t') + ''', count(*)
+            FROM tasks t
+            JOIN habits h ON h.id = t.habit_id AND h.user_id = t.user_id
+            WHERE h.id = ANY(%s) AND t.completed
+            GROUP BY 1, 2
+        ''', (habit_ids,))
+
+def owned_habit_id(conn, value, user_id):
+    """The habit id in a form value, checked to be one of the user's habits.
+
+    Returns None for an empty value; raises ValueError for anything else
+    that isn't the id of one of the user's habits.
+    """
+    if value in (None, ''):
+        return None
+    try:
+        habit_id = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('habit_id must be an integer.')
+    with conn.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM habits WHERE id = %s AND user_id = %s', (habit_id, user_id))
+        if cursor.fetchone() is None:
+            raise ValueError('Habit not found.')
+    return habit_id
+
+def update_task(conn, task_id, user_id, habit_id, name, description, task_date):
+    """Update a task's fields, rebuilding habit progress if a completed task moved."""
+    with conn.cursor() as cursor:
+        cursor.execute('''
+            UPDATE tasks t
+            SET habit_id = %s, name = %s, description = %s, date = %s
+            FROM (SELECT id, habit_id, date FROM tasks WHERE id = %s AND user_id = %s FOR UPDATE) old
+            WHERE t.id = old.id
+            RETURNING ''' + ', '.join('t.' + c for c in TASK_COLUMNS.split(', ')) + ''',
+                      old.habit_id AS old_habit_id, old.date AS old_date
+        ''', (habit_id, name, description, task_date, task_id, user_id))
+        task = cursor.fetchone()
+    if task:
+        old_habit_id = task.pop('old_habit_id')
+        old_date = task.pop('old_date')
+        if task['completed'] and (old_habit_id, old_date) != (task['habit_id'], task['date']):
+            rebuild_habit_progress(conn, {old_habit_id, task['habit_id']} - {None})
+        bump_data_version(conn, user_id)
+    conn.commit()
+    return task
+
+def delete_task_row(conn, task_id, user_id):
+    """Delete a task, taking it out of its habit's period count if completed.
+
+    Returns the deleted task's id and habit_id, or None if there was no such task.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute('''
+            WITH removed AS (
+                DELETE FROM tasks
+                WHERE id = %s AND user_id = %s
+                RETURNING id, user_id, habit_id, date, completed, completed_on
+            ), uncounted AS (
+                -- Upsert rather than UPDATE, so a bucket row inserted after
+                -- this statement's snapshot is still decremented
+                INSERT INTO habit_completions AS hc (habit_id, period_start, completed)
+                SELECT h.id, ''' + PERIOD_BUCKET.format(period='h.period', task='r') + ''', 0
+                FROM removed r
+                JOIN habits h ON h.id = r.habit_id AND h.user_id = r.user_id
+                WHERE r.completed
+                ON CONFLICT (habit_id, period_start) DO UPDATE SET completed = GREATEST(hc.completed - 1, 0)
+            ), bumped AS (
+                UPDATE users SET data_version = data_version + 1
+                WHERE id = %s AND EXISTS (SELECT 1 FROM removed)
+            )
+            SELECT id, habit_id FROM removed
+        ''', (task_id, user_id, user_id))
+        deleted = cursor.fetchone()
+    conn.commit()
+    return deleted
+
+def toggle_task_status(conn, task_id, user_id):
+    """Flip a task's completed flag and adjust its habit's counters.
+
+    The task, the habit's lifetime counter and its period bucket are all
+    updated in one statement, so concurrent toggles of the same task
+    serialize on the task's row lock and the counters can't drift. Returns
+    the updated (task, habit) rows; task is None if the task doesn't exist
+    and habit is None if the task isn't linked to one. The habit carries its
+    current-period progress as period_completed.
+    """
+    bucket = PERIOD_BUCKET.format(period='a.period', task='t')
+    current = PERIOD_START.format(period='a.period', day='%(today)s')
+    with conn.cursor() as cursor:
+        cursor.execute('''
+            WITH toggled AS (
+                UPDATE tasks
+                SET completed = completed IS NOT TRUE,
+                    completed_on = CASE WHEN completed IS NOT TRUE THEN %(today)s ELSE completed_on END
+                WHERE id = %(task_id)s AND user_id = %(user_id)s
+                RETURNING ''' + TASK_COLUMNS + ''', completed_on
+            ), adjusted AS (
+                UPDATE habits h
+                SET times_completed = GREATEST(h.times_completed + CASE WHEN t.completed THEN 1 ELSE -1 END, 0)
+                FROM toggled t
+                WHERE h.id = t.habit_id AND h.user_id = t.user_id
+                RETURNING h.id, h.user_id, h.name, h.frequency, h.period, h.times_completed
+            ), changed AS (
+                -- An upsert in both directions: a plain UPDATE would miss a
+                -- bucket row inserted after this statement's snapshot
+                INSERT INTO habit_completions AS hc (habit_id, period_start, completed)
+                SELECT a.id, ''' + bucket + ''', CASE WHEN t.completed THEN 1 ELSE 0 END
+                FROM toggled t JOIN adjusted a ON a.id = t.habit_id
+                ON CONFLICT (habit_id, period_start) DO UPDATE
+                SET completed = GREATEST(hc.completed + CASE WHEN EXCLUDED.completed = 1 THEN 1 ELSE -1 END, 0)
+                RETURNING hc.habit_id, hc.period_start, hc.completed
+            ), bumped AS (
+                UPDATE users SET data_version = data_version + 1
+                WHERE id = %(user_id)s AND EXISTS (SELECT 1 FROM toggled)
+            )
+            SELECT t.id, t.user_id, t.habit_id, t.name, t.description, t.date, t.completed,
+                   CASE WHEN a.id IS NOT NULL THEN json_build_object(
+                       'id', a.id, 'user_id', a.user_id, 'name', a.name,
+                       'frequency', a.frequency, 'period', a.period,
+                       'times_completed', a.times_completed,
+                       -- The statement can't see its own writes, so take the
+                       -- changed bucket if it's the current one
+                       'period_completed', COALESCE(
+                           (SELECT c.completed FROM changed c
+                            WHERE c.period_start = ''' + current + '''),
+                           (SELECT hc.completed FROM habit_completions hc
+                            WHERE hc.habit_id = a.id
+                              AND hc.period_start = ''' + current + '''),
+                           0)
+                   ) END AS habit
+            FROM toggled t LEFT JOIN adjusted a ON a.id = t.habit_id
+        ''', {'task_id': task_id, 'user_id': user_id, 'today': date.today()})
+        task = cursor.fetchone()
+    conn.commit()
+    if not task:
+        return None, None
+    habit = task.pop('habit')
+    return task, habit
+
+def complete_tasks(conn, task_ids, user_id):
+    """Mark several tasks completed in one statement.
+
+    Tasks that are already completed are left alone and don't count towards
+    their habit again. Returns the newly completed tasks and the progress of
+    the habits whose counters changed.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute('''
+            WITH done AS (
+                UPDATE tasks
+                SET completed = TRUE, completed_on = %(today)s
+                WHERE user_id = %(user_id)s AND id = ANY(%(task_ids)s) AND completed IS NOT TRUE
+                RETURNING ''' + TASK_COLUMNS + ''', completed_on
+            ), counts AS (
+                SELECT habit_id, count(*) AS n
+                FROM done
+                WHERE habit_id IS NOT NULL
+                GROUP BY habit_id
+            ), adjusted AS (
+                UPDATE habits h
+                SET times_completed = h.times_completed + c.n
+                FROM counts c
+                WHERE h.id = c.habit_id AND h.user_id = %(user_id)s
+                RETURNING h.id
+            ), counted AS (
+                INSERT INTO habit_completions AS hc (habit_id, period_start, completed)
+                SELECT h.id, ''' + PERIOD_BUCKET.format(period='h.period', task='d') + ''', count(*)
+                FROM done d JOIN habits h ON h.id = d.habit_id AND h.user_id = d.user_id
+                GROUP BY 1, 2
+                ON CONFLICT (habit_id, period_start) DO UPDATE SET completed = hc.completed + EXCLUDED.completed
+            ), bumped AS (
+                UPDATE users SET data_version = data_version + 1
+                WHERE id = %(user_id)s AND EXISTS (SELECT 1 FROM done)
+            )
+            SELECT ''' + TASK_COLUMNS + ''' FROM done ORDER BY id
+        ''', {'task_ids': list(task_ids), 'user_id': user_id, 'today': date.today()})
+        tasks = cursor.fetchall()
+    conn.commit()
+    habit_ids = {t['habit_id'] for t in tasks if t['habit_id']}
+    habits = habit_progress(conn, user_id, habit_ids) if habit_ids else []
+    return tasks, habits
+
 @app.route('/toggle_task/<int:task_id>', methods=['POST'])
 @login_required
 def toggle_task(task_id):
-    view_type = request.args.get('view', 'day')
-    conn = get_db_connection()
+    task, _ = toggle_task_status(get_db(), task_id, current_user.id)
+    if task:
+        flash('Task status updated.', 'success')
+    else:
+        flash('Task not found.', 'danger')
+    # Back to the same view, range and to-do page the form was posted from
+    return redirect(url_for('tasks', **request.args.to_dict()))
+
+# Recurring tasks. Each period a habit gets `frequency` tasks, spread evenly
+# over the period's days; the scheduler creates the ones falling within the
+# next SCHEDULE_HORIZON_DAYS. Run it nightly with `flask schedule-habit-tasks`.
+SCHEDULE_HORIZON_DAYS = int(os.environ.get('SCHEDULE_HORIZON_DAYS', 14))
+# Upper bound on tasks per habit per period, whatever its frequency
+MAX_OCCURRENCES_PER_PERIOD = 366
+
+def schedule_habit_tasks(conn, user_ids, today, horizon_days=SCHEDULE_HORIZON_DAYS):
+    """Create the tasks due from today through the horizon for these users' habits.
+
+    Idempotent: every occurrence is claimed in habit_occurrences first, so
+    reruns and concurrent runs never create a task twice. Each claim
+    records the task it created. Commits and returns the number of tasks
+    created.
+    """
     with conn.cursor() as cursor:
-        cursor.execute('SELECT * FROM tasks WHERE id = %s AND user_id = %s', (task_id, current_user.id))
-        task = cursor.fetchone()
-        if task:
-            new_status = not task['completed']
-            cursor.execute('UPDATE tasks SET completed = %s WHERE id = %s AND user_id = %s',
-                           (new_status, task_id, current_user.id))
-            # Adjust habit completion if necessary
-            if task['habit_id']:
-                if new_status:
-                    cursor.execute('''
-                        UPDATE habits
-                        SET times_completed = times_completed + 1
-                        WHERE id = %s AND user_id = %s
-                    ''', (task['habit_id'], current_user.id))
-                else:
+        cursor.execute('''
+            WITH slots AS (
+                SELECT h.id AS habit_id, h.user_id, h.name, p.period_start, k AS occurrence,
+                       p.period_start + k * p.days / h.frequency AS due
+                FROM habits h
+                CROSS JOIN LATERAL (
+                    SELECT s::date AS period_start, (s + ('1 ' || h.period)::interval)::date - s::date AS days
+                    FROM generate_series(''' + PERIOD_START.format(period='h.period', day='%(today)s') + '''::timestamp,
+                                         %(until)s::timestamp, ('1 ' || h.period)::interval) s
+                ) p
+                CROSS JOIN LATERAL generate_series(0, LEAST(h.frequency, %(max_occurrences)s) - 1) k
+                WHERE h.user_id = ANY(%(user_ids)s) AND h.frequency > 0
+            ), due AS (
+                SELECT * FROM slots WHERE due BETWEEN %(today)s AND %(until)s
+            ), claimed AS (
+                -- Each claim takes its task's id up front; the existence check
+                -- keeps reruns from drawing ids for occurrences already claimed
+                INSERT INTO habit_occurrences (habit_id, period_start, occurrence, task_id)
+                SELECT habit_id, period_start, occurrence, nextval(pg_get_serial_sequence('tasks', 'id'))
+                FROM due d
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM habit_occurrences o
+                    WHERE (o.habit_id, o.period_start, o.occurrence) = (d.habit_id, d.period_start, d.occurrence)
+                )
+                ON CONFLICT DO NOTHING
+                RETURNING habit_id, period_start, occurrence, task_id
+            ), created AS (
+                INSERT INTO tasks (id, user_id, habit_id, name, date, completed)
+                SELECT c.task_id, d.user_id, d.habit_id, d.name, d.due, FALSE
+                FROM claimed c JOIN due d USING (habit_id, period_start, occurrence)
+                RETURNING user_id
+            ), bumped AS (
+                UPDATE users SET data_version = data_version + 1
+                WHERE id IN (SELECT user_id FROM created)
+            ), pruned AS (
+                -- No period that started over a year ago has occurrences still to come
+                DELETE FROM habit_occurrences o USING habits h
+                WHERE o.habit_id = h.id AND h.user_id = ANY(%(user_ids)s)
+                  AND o.period_start < %(today)s::date - 366
+            )
+            SELECT count(*) AS created FROM created
+        ''', {'user_ids': list(user_ids), 'today': today, 'until': today + timedelta(days=horizon_days),
+              'max_occurrences': MAX_OCCURRENCES_PER_PERIOD})
+        created = cursor.fetchone()['created']
+    conn.commit()
+    return created
+
+def schedule_all_habit_tasks(pool, today, horizon_days=SCHEDULE_HORIZON_DAYS, chunk_size=500, workers=4,
+                             progress=None):
+    """Run schedule_habit_tasks over every user with habits, a chunk of users at a time.
+
+    Chunks run concurrently on ``workers`` threads, each with its own pooled
+    connection. Returns (tasks created, failed chunks); a failed chunk is
+    rolled back and can simply be retried by running again.
+    """
+    def run_chunk(user_ids):
+        conn = pool.getconn()
+        try:
+            return schedule_habit_tasks(conn, user_ids, today, horizon_days)
+        finally:
+            pool.putconn(conn)
+
+    def user_chunks():
+        conn = pool.getconn()
+        try:
+            last_id = 0
+            while True:
+                with conn.cursor() as cursor:
                     cursor.execute('''
-                        UPDATE habits
-                        SET times_completed = times_completed - 1
-                        WHERE id = %s AND user_id = %s AND times_completed > 0
-                    ''', (task['habit_id'], current_user.id))
-            conn.commit()
-            flash('Task status updated.', 'success')
+                        SELECT DISTINCT user_id FROM habits WHERE user_id > %s
+                        ORDER BY user_id LIMIT %s
+                    ''', (last_id, chunk_size))
+                    user_ids = [row['user_id'] for row in cursor.fetchall()]
+                conn.rollback()
+                if not user_ids:
+                    return
+                yield user_ids
+                last_id = user_ids[-1]
+        finally:
+            pool.putconn(conn)
+
+    created = 0
+    failures = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for user_ids in user_chunks():
+            # Keep a bounded number of chunks queued ahead of the workers
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                created += collect_chunks(done, failures, progress)
+            future = executor.submit(run_chunk, user_ids)
+            future.user_ids = user_ids
+            pending.add(future)
+        created += collect_chunks(pending, failures, progress)
+    return created, failures
+
+def collect_chunks(futures, failures, progress):
+    created = 0
+    for future in futures:
+        try:
+            n = future.result()
+        except Exception as e:
+            failures.append((future.user_ids[0], future.user_ids[-1], e))
+            continue
+        created += n
+        if progress:
+            progress(future.user_ids, n)
+    return created
+
+# Bulk import/export. Exports stream straight out of COPY; imports are read,
+# validated with the form rules and written with COPY in batches, all in one
+# transaction. Per-user files describe the signed-in user's data; whole-
+# database files name each row's owner by username and need
+# Authorization: Bearer $ADMIN_TOKEN (those endpoints are off without it).
+app.config.setdefault('ADMIN_TOKEN', os.environ.get('ADMIN_TOKEN'))
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 10000))
+MAX_IMPORT_ERRORS = 100
+TRANSFER_KINDS = ('users', 'habits', 'tasks')
+TRUE_VALUES = ('t', 'true', '1', 'yes')
+
+EXPORT_COLUMNS = {
+    'habits': 'x.id, {owner}x.name, x.frequency, x.period, x.times_completed',
+    'tasks': 'x.id, {owner}x.habit_id, x.name, x.description, x.date, x.completed, x.completed_on',
+}
+
+def export_query(kind, user_id=None):
+    """Query and parameters for exporting one user's rows, or every row if user_id is None."""
+    if kind == 'users':
+        return 'SELECT username, password FROM users ORDER BY id', ()
+    if user_id is not None:
+        return ('SELECT ' + EXPORT_COLUMNS[kind].format(owner='') + ' FROM ' + kind + ' x'
+                ' WHERE x.user_id = %s ORDER BY x.id', (user_id,))
+    return ('SELECT ' + EXPORT_COLUMNS[kind].format(owner='u.username, ') + ' FROM ' + kind + ' x'
+            ' JOIN users u ON u.id = x.user_id ORDER BY x.id', ())
+
+class DataImport:
+    """One import run: users, then habits, then tasks, fed in batches.
+
+    Habit ids are allocated from the sequence up front so tasks' habit_id
+    can be remapped to the new rows. Invalid rows are skipped and reported.
+    """
+
+    def __init__(self, conn, user_id=None):
+        self.conn = conn
+        self.user_id = user_id
+        self.usernames = {}  # username -> user id, for whole-database imports
+        self.habit_ids = {}  # exported habit id -> (new habit id, owner id)
+        self.touched_users = set()
+        self.habit_form = HabitForm(formdata=None, meta={'csrf': False})
+        self.task_form = TaskForm(formdata=None, meta={'csrf': False})
+        self.checked = {}  # (form, field, value) -> (data, error), per batch
+        self.result = {'users': 0, 'habits': 0, 'tasks': 0, 'skipped': 0, 'errors': []}
+        self.start = time.perf_counter()
+
+    def reject(self, kind, line, message):
+        self.result['skipped'] += 1
+        if len(self.result['errors']) < MAX_IMPORT_ERRORS:
+            self.result['errors'].append('%s line %d: %s' % (kind, line, message))
+
+    def validate(self, form, row, fields):
+        """(field data, None) for ``row`` under the form's rules, or (None, error).
+
+        Each distinct value is checked once per batch; dates and habit ids
+        repeat across most rows of an export.
+        """
+        data = {}
+        for name in fields:
+            value = row.get(name)
+            value = '' if value is None else str(value)
+            key = (form.__class__, name, value)
+            checked = self.checked.get(key)
+            if checked is None:
+                field = form[name]
+                field.process(MultiDict({name: value} if value else {}))
+                valid = field.validate(form)
+                checked = self.checked[key] = (field.data, None if valid else ' '.join(field.errors))
+            if checked[1]:
+                return None, '%s: %s' % (name, checked[1])
+            data[name] = checked[0]
+        return data, None
+
+    def resolve_owners(self, batch):
+        if self.user_id is not None:
+            return
+        wanted = {str(row['username']) for _, row in batch
+                  if row and row.get('username') and str(row['username']) not in self.usernames}
+        if wanted:
+            with self.conn.cursor() as cursor:
+                cursor.execute('SELECT id, username FROM users WHERE username = ANY(%s)', (list(wanted),))
+                self.usernames.update((r['username'], r['id']) for r in cursor.fetchall())
+
+    def owner(self, row):
+        if self.user_id is not None:
+            return self.user_id
+        return self.usernames.get(str(row.get('username')))
+
+    def add_users(self, batch):
+        rows = []
+        for line, row in batch:
+            if row is None:
+                self.reject('users', line, 'not a JSON object')
+            elif not row.get('username') or len(str(row['username'])) > 150:
+                self.reject('users', line, 'username must be 1 to 150 characters')
+            elif not row.get('password') or len(str(row['password'])) > 255:
+                self.reject('users', line, 'password hash must be 1 to 255 characters')
+            else:
+                rows.append((str(row['username']), str(row['password'])))
+        if rows:
+            # Existing users keep their password; their rows below are merged in
+            with self.conn.cursor() as cursor:
+                inserted = execute_values(cursor, '''
+                    INSERT INTO users (username, password) VALUES %s
+                    ON CONFLICT (username) DO NOTHING RETURNING id, username
+                ''', rows, fetch=True)
+            self.usernames.update((r['username'], r['id']) for r in inserted)
+            self.result['users'] += len(inserted)
+
+    def add_habits(self, batch):
+        self.resolve_owners(batch)
+        self.checked.clear()
+        rows = []
+        for line, row in batch:
+            if row is None:
+                self.reject('habits', line, 'not a JSON object')
+                continue
+            owner = self.owner(row)
+            if owner is None:
+                self.reject('habits', line, 'unknown user')
+                continue
+            data, error = self.validate(self.habit_form, row, ('name', 'frequency', 'period'))
+            if error:
+                self.reject('habits', line, error)
+                continue
+            rows.append((row.get('id'), owner, data['name'], data['frequency'], data['period']))
+        if not rows:
+            return
+        with self.conn.cursor() as cursor:
+            cursor.execute("SELECT nextval(pg_get_serial_sequence('habits', 'id')) AS id "
+                           "FROM generate_series(1, %s)", (len(rows),))
+            new_ids = [r['id'] for r in cursor.fetchall()]
+        for new_id, (old_id, owner, *_) in zip(new_ids, rows):
+            if old_id not in (None, ''):
+                self.habit_ids[str(old_id)] = (new_id, owner)
+            self.touched_users.add(owner)
+        transfer.copy_in(self.conn, 'habits', ('id', 'user_id', 'name', 'frequency', 'period', 'times_completed'),
+                         ((new_id,) + row[1:] + (0,) for new_id, row in zip(new_ids, rows)))
+        self.result['habits'] += len(rows)
+
+    def add_tasks(self, batch):
+        self.resolve_owners(batch)
+        self.checked.clear()
+        rows = []
+        for line, row in batch:
+            if row is None:
+                self.reject('tasks', line, 'not a JSON object')
+                continue
+            owner = self.owner(row)
+            if owner is None:
+                self.reject('tasks', line, 'unknown user')
+                continue
+            data, error = self.validate(self.task_form, row, ('name', 'description', 'date', 'habit_id'))
+            if error:
+                self.reject('tasks', line, error)
+                continue
+            habit_id = None
+            if data['habit_id']:
+                habit = self.habit_ids.get(data['habit_id'])
+                if habit is None or habit[1] != owner:
+                    self.reject('tasks', line, 'habit_id %s is not in this import' % data['habit_id'])
+                    continue
+                habit_id = habit[0]
+            completed = row.get('completed') is True or str(row.get('completed')).lower() in TRUE_VALUES
+            completed_on = None
+            if completed and row.get('completed_on'):
+                try:
+                    completed_on = date.fromisoformat(str(row['completed_on']))
+                except ValueError:
+                    self.reject('tasks', line, 'completed_on: Not a valid date value.')
+                    continue
+            rows.append((owner, habit_id, data['name'], data['description'], data['date'],
+                         completed, completed_on))
+            self.touched_users.add(owner)
+        if rows:
+            transfer.copy_in(self.conn, 'tasks', ('user_id', 'habit_id', 'name', 'description', 'date',
+                                                  'completed', 'completed_on'), rows)
+            self.result['tasks'] += len(rows)
+
+    def finish(self):
+        """Recount the new habits' progress, bump versions and commit; returns the result."""
+        new_habits = [habit_id for habit_id, _ in self.habit_ids.values()]
+        with self.conn.cursor() as cursor:
+            for i in range(0, len(new_habits), 500):
+                chunk = new_habits[i:i + 500]
+                cursor.execute('''
+                    UPDATE habits h SET times_completed = c.n
+                    FROM (
+                        SELECT habit_id, count(*) AS n FROM tasks
+                        WHERE habit_id = ANY(%s) AND completed
+                        GROUP BY habit_id
+                    ) c
+                    WHERE h.id = c.habit_id
+                ''', (chunk,))
+                rebuild_habit_progress(self.conn, chunk)
+            if self.touched_users:
+                cursor.execute('UPDATE users SET data_version = data_version + 1 WHERE id = ANY(%s)',
+                               (list(self.touched_users),))
+        self.conn.commit()
+        elapsed = time.perf_counter() - self.start
+        rows = self.result['users'] + self.result['habits'] + self.result['tasks'] + self.result['skipped']
+        self.result['seconds'] = round(elapsed, 3)
+        self.result['rows_per_sec'] = round(rows / elapsed) if elapsed else rows
+        return self.result
+
+def import_data(conn, sources, user_id=None, batch_size=IMPORT_BATCH_SIZE):
+    """Import {kind: (binary file, format)} into one user, or by username if user_id is None.
+
+    Raises ValueError (after rolling back) if a file can't be parsed or
+    holds values the columns can't store.
+    """
+    run = DataImport(conn, user_id)
+    adders = {'users': run.add_users, 'habits': run.add_habits, 'tasks': run.add_tasks}
+    try:
+        for kind in TRANSFER_KINDS:
+            if kind in sources:
+                f, fmt = sources[kind]
+                for batch in transfer.batched(transfer.read_rows(f, fmt), batch_size):
+                    adders[kind](batch)
+    except (ValueError, DataError) as e:
+        conn.rollback()
+        raise ValueError('%s: %s' % (kind, str(e).strip()))
+    return run.finish()
+
+def export_response(kind, fmt, user_id=None):
+    query, params = export_query(kind, user_id)
+    body = stream_with_context(transfer.stream_copy_out(get_db(), query, params, fmt))
+    response = app.response_class(body, mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson')
+    response.headers['Content-Disposition'] = 'attachment; filename=%s.%s' % (kind, fmt)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+def import_response(kinds, user_id=None):
+    """Import the uploaded files named after ``kinds``; format from a format field, ?format= or the file names."""
+    sources = {}
+    for kind in kinds:
+        upload = request.files.get(kind)
+        if upload:
+            fmt = request.values.get('format') or transfer.format_for(upload.filename)
+            if fmt not in transfer.FORMATS:
+                return api_error('Unknown format for %s; use .csv or .ndjson files.' % kind, 400)
+            sources[kind] = (upload.stream, fmt)
+    if not sources:
+        return api_error('Upload one or more of: %s.' % ', '.join(kinds), 400)
+    try:
+        result = import_data(get_db(), sources, user_id)
+    except ValueError as e:
+        return api_error(str(e), 400)
+    return jsonify(result)
+
+def require_admin_token():
+    token = app.config['ADMIN_TOKEN']
+    if not token:
+        abort(404)
+    if request.headers.get('Authorization') != 'Bearer ' + token:
+        abort(401)
+
+# Route: Whole-database Export
+@app.route('/admin/export/<kind>.<fmt>')
+def admin_export(kind, fmt):
+    require_admin_token()
+    if kind not in TRANSFER_KINDS or fmt not in transfer.FORMATS:
+        abort(404)
+    return export_response(kind, fmt)
+
+# Route: Whole-database Import
+@app.route('/admin/import', methods=['POST'])
+def admin_import():
+    require_admin_token()
+    return import_response(TRANSFER_KINDS)
+
+# JSON API used by static/js/scripts.js to update the tasks page in place.
+# Mutating endpoints expect the CSRF token in an X-CSRFToken header.
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# Answer unauthenticated API calls with 401 instead of a login redirect
+login_manager.blueprint_login_views['api'] = None
+
+MAX_BULK_TASKS = 1000
+
+def task_json(task):
+    return {
+        'id': task['id'],
+        'habit_id': task['habit_id'],
+        'name': task['name'],
+        'description': task['description'],
+        'date': task['date'].isoformat() if task['date'] else None,
+        'completed': task['completed'],
+    }
+
+def habit_json(habit):
+    data = {
+        'id': habit['id'],
+        'name': habit['name'],
+        'frequency': habit['frequency'],
+        'period': habit['period'],
+        'times_completed': habit['times_completed'],
+        'period_completed': habit['period_completed'],
+        'remaining': max(habit['frequency'] - habit['period_completed'], 0),
+    }
+    if 'streak' in habit:
+        data['streak'] = habit['streak']
+    return data
+
+def api_error(message, status):
+    return jsonify(error=message), status
+
+def parse_date_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        abort(400, description='Invalid %s date.' % name)
+
+@api.before_request
+def check_api_csrf():
+    if request.method in ('POST', 'PATCH', 'PUT', 'DELETE') and app.config.get('WTF_CSRF_ENABLED', True):
+        try:
+            validate_csrf(request.headers.get('X-CSRFToken'))
+        except ValidationError as e:
+            return api_error(str(e), 400)
+
+@api.errorhandler(400)
+@api.errorhandler(401)
+@api.errorhandler(404)
+def api_http_error(e):
+    return api_error(e.description, e.code)
+
+@api.route('/habits')
+@login_required
+def api_habits():
+    habits = habit_progress(get_db(), current_user.id)
+    return jsonify(habits=[habit_json(h) for h in habits])
+
+@api.route('/tasks')
+@login_required
+def api_tasks():
+    """Undated tasks, or dated tasks between ?start= and ?end= (inclusive)."""
+    start = parse_date_arg('start')
+    end = parse_date_arg('end')
+    with get_db().cursor() as cursor:
+        if start and end:
+            cursor.execute('''
+                SELECT ''' + TASK_COLUMNS + ''' FROM tasks
+                WHERE user_id = %s AND date BETWEEN %s AND %s
+                ORDER BY date, id
+            ''', (current_user.id, start, end))
         else:
-            flash('Task not found.', 'danger')
-    conn.close()
-    return redirect(url_for('tasks', view=view_type))
+            cursor.execute('''
+                SELECT ''' + TASK_COLUMNS + ''' FROM tasks
+                WHERE user_id = %s AND date IS NULL
+                ORDER BY id
+            ''', (current_user.id,))
+        tasks = cursor.fetchall()
+    return jsonify(tasks=[task_json(t) for t in tasks])
+
+@api.route('/tasks/<int:task_id>/toggle', methods=['POST'])
+@login_required
+def api_toggle_task(task_id):
+    task, habit = toggle_task_status(get_db(), task_id, current_user.id)
+    if not task:
+        return api_error('Task not found.', 404)
+    return jsonify(task=task_json(task), habit=habit_json(habit) if habit else None)
+
+@api.route('/tasks/complete', methods=['POST'])
+@login_required
+def api_complete_tasks():
+    """Complete every task in the JSON body's task_ids list at once."""
+    payload = request.get_json(silent=True)
+    task_ids = payload.get('task_ids') if isinstance(payload, dict) else None
+    if (not isinstance(task_ids, list) or not task_ids
+            or not all(isinstance(i, int) and not isinstance(i, bool) for i in task_ids)):
+        return api_error('Expected a non-empty task_ids list of integers.', 400)
+    if len(task_ids) > MAX_BULK_TASKS:
+        return api_error('At most %d tasks can be completed at once.' % MAX_BULK_TASKS, 400)
+    tasks, habits = complete_tasks(get_db(), task_ids, current_user.id)
+    return jsonify(tasks=[task_json(t) for t in tasks], habits=[habit_json(h) for h in habits])
+
+@api.route('/tasks/<int:task_id>', methods=['DELETE'])
+@login_required
+def api_delete_task(task_id):
+    conn = get_db()
+    task = delete_task_row(conn, task_id, current_user.id)
+    if not task:
+        return api_error('Task not found.', 404)
+    habits = habit_progress(conn, current_user.id, [task['habit_id']]) if task['habit_id'] else []
+    return jsonify(deleted=task_id, habit=habit_json(habits[0]) if habits else None)
+
+@api.route('/tasks/<int:task_id>', methods=['PATCH'])
+@login_required
+def api_update_task(task_id):
+    """Partial update; fields missing from the JSON body keep their values."""
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return api_error('Expected a JSON object.', 400)
+    conn = get_db()
+    with conn.cursor() as cursor:
+        cursor.execute('SELECT ' + TASK_COLUMNS + ' FROM tasks WHERE id = %s AND user_id = %s',
+                       (task_id, current_user.id))
+        task = cursor.fetchone()
+    if not task:
+        return api_error('Task not found.', 404)
+
+    # Validate the merged row with the same rules as the HTML form
+    fields = task_json(task)
+    fields.update({k: payload[k] for k in ('name', 'description', 'date', 'habit_id') if k in payload})
+    formdata = MultiDict({k: '' if fields[k] is None else str(fields[k])
+                          for k in ('name', 'description', 'date', 'habit_id')})
+    form = TaskForm(formdata=formdata, meta={'csrf': False})
+    if not form.validate():
+        return jsonify(errors=form.errors), 400
+    try:
+        habit_id = owned_habit_id(conn, form.habit_id.data, current_user.id)
+    except ValueError as e:
+        return jsonify(errors={'habit_id': [str(e)]}), 400
+    old_habit_id = task['habit_id']
+    task = update_task(conn, task_id, current_user.id, habit_id, form.name.data,
+                       form.description.data, form.date.data)
+    if not task:
+        return api_error('Task not found.', 404)
+    # Moving a completed task changes both habits' counts
+    habit_ids = {old_habit_id, task['habit_id']} - {None}
+    habits = habit_progress(conn, current_user.id, habit_ids) if habit_ids else []
+    return jsonify(task=task_json(task), habits=[habit_json(h) for h in habits])
+
+@api.route('/export/<kind>.<fmt>')
+@login_required
+def api_export(kind, fmt):
+    """Stream the user's habits or tasks as CSV or NDJSON."""
+    if kind not in ('habits', 'tasks') or fmt not in transfer.FORMATS:
+        abort(404)
+    return export_response(kind, fmt, current_user.id)
+
+@api.route('/import', methods=['POST'])
+@login_required
+def api_import():
+    """Add the habits and tasks from uploaded files (as exported) to the user's own."""
+    return import_response(('habits', 'tasks'), current_user.id)
+
+app.register_blueprint(api)
+
+metrics.register_collector('db_pool', lambda: db.get_pool().stats())
+metrics.register_collector('user_cache', user_cache.stats)
+metrics.register_collector('fragment_cache', fragment_cache.stats)
+metrics.register_collector('password_hash', password_hasher.stats)
+
+@app.cli.command('migrate')
+@click.option('--status', 'show_status', is_flag=True, help='List migrations instead of applying them.')
+def migrate_command(show_status):
+    """Apply pending schema migrations."""
+    dsn = app.config['DATABASE_URL']
+    if show_status:
+        for version, name, applied in schema.status(dsn):
+            click.echo('%04d_%s  %s' % (version, name, 'applied' if applied else 'pending'))
+        return
+    start = time.perf_counter()
+    done = schema.migrate(dsn, log=click.echo)
+    click.echo('Applied %d migrations in %.2fs' % (len(done), time.perf_counter() - start))
+
+@app.cli.command('build-assets')
+@click.option('--clean', is_flag=True, help='Delete files left over from earlier builds.')
+def build_assets(clean):
+    """Fingerprint static files, resize images and precompress CSS/JS."""
+    manifest = assets.build(app.static_folder, app.config['ASSET_IMAGE_WIDTHS'], clean=clean, log=click.echo)
+    click.echo('Built %d files, %d with image variants; restart the app to serve them'
+               % (len(manifest['files']), len(manifest['srcsets'])))
+
+@app.cli.command('backfill-habit-progress')
+@click.option('--batch-size', default=500, show_default=True, help='Habits rebuilt per transaction.')
+def backfill_habit_progress(batch_size):
+    """Build habit_completions from existing tasks."""
+    conn = get_db()
+    last_id = 0
+    total = 0
+    while True:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT id FROM habits WHERE id > %s ORDER BY id LIMIT %s', (last_id, batch_size))
+            habit_ids = [row['id'] for row in cursor.fetchall()]
+        if not habit_ids:
+            break
+        rebuild_habit_progress(conn, habit_ids)
+        conn.commit()
+        total += len(habit_ids)
+        last_id = habit_ids[-1]
+        click.echo('Rebuilt progress for %d habits' % total)
+
+@app.cli.command('schedule-habit-tasks')
+@click.option('--horizon', default=SCHEDULE_HORIZON_DAYS, show_default=True,
+              help='Days ahead to create habit tasks for.')
+@click.option('--chunk-size', default=500, show_default=True, help='Users per transaction.')
+@click.option('--workers', default=4, show_default=True, help='Chunks processed at once.')
+def schedule_habit_tasks_command(horizon, chunk_size, workers):
+    """Create upcoming tasks for every habit; safe to rerun."""
+    start = time.perf_counter()
+    users = []
+
+    def progress(user_ids, created):
+        users.append(len(user_ids))
+        click.echo('Scheduled users %d-%d: %d tasks' % (user_ids[0], user_ids[-1], created))
+
+    created, failures = schedule_all_habit_tasks(db.get_pool(), date.today(), horizon, chunk_size, workers,
+                                                 progress)
+    for first, last, error in failures:
+        click.echo('Users %d-%d failed: %s' % (first, last, error), err=True)
+    click.echo('Created %d tasks for %d users in %.1fs' % (created, sum(users), time.perf_counter() - start))
+    if failures:
+        raise SystemExit(1)
+
+def find_user_id(username):
+    with get_db().cursor() as cursor:
+        cursor.execute('SELECT id FROM users WHERE username = %s', (username,))
+        row = cursor.fetchone()
+    if not row:
+        raise click.ClickException('No user named %r.' % username)
+    return row['id']
+
+@app.cli.command('export-data')
+@click.argument('kind', type=click.Choice(TRANSFER_KINDS))
+@click.argument('output', type=click.Path(dir_okay=False, allow_dash=True))
+@click.option('--user', 'username', help="Export one user's rows instead of the whole database.")
+@click.option('--format', 'fmt', type=click.Choice(transfer.FORMATS),
+              help='Defaults to the output file extension, else csv.')
+def export_data(kind, output, username, fmt):
+    """Write users, habits or tasks to OUTPUT (- for stdout) with COPY."""
+    user_id = find_user_id(username) if username else None
+    if kind == 'users' and user_id is not None:
+        raise click.BadParameter('users can only be exported for the whole database', param_hint='--user')
+    fmt = fmt or transfer.format_for(output, 'csv')
+    query, params = export_query(kind, user_id)
+    start = time.perf_counter()
+    with click.open_file(output, 'wb') as out:
+        rows = transfer.copy_out(get_db(), query, params, fmt, out)
+    elapsed = time.perf_counter() - start
+    click.echo('Exported %d %s in %.1fs (%d rows/s)' % (rows, kind, elapsed, rows / elapsed if elapsed else rows),
+               err=True)
+
+@app.cli.command('import-data')
+@click.option('--users', 'users_path', type=click.Path(exists=True, dir_okay=False), help='Users file.')
+@click.option('--habits', 'habits_path', type=click.Path(exists=True, dir_okay=False), help='Habits file.')
+@click.option('--tasks', 'tasks_path', type=click.Path(exists=True, dir_okay=False), help='Tasks file.')
+@click.option('--user', 'username', help='Import everything into this existing user.')
+@click.option('--format', 'fmt', type=click.Choice(transfer.FORMATS),
+              help='Defaults to each file extension.')
+@click.option('--batch-size', default=IMPORT_BATCH_SIZE, show_default=True, help='Rows validated per batch.')
+def import_data_command(users_path, habits_path, tasks_path, username, fmt, batch_size):
+    """Load exported users, habits and tasks with COPY."""
+    user_id = find_user_id(username) if username else None
+    if users_path and user_id is not None:
+        raise click.BadParameter('users can only be imported for the whole database', param_hint='--user')
+    paths = {'users': users_path, 'habits': habits_path, 'tasks': tasks_path}
+    with ExitStack() as stack:
+        sources = {}
+        for kind, path in paths.items():
+            if path:
+                kind_fmt = fmt or transfer.format_for(path)
+                if not kind_fmt:
+                    raise click.BadParameter('cannot tell the format of %s' % path, param_hint='--format')
+                sources[kind] = (stack.enter_context(open(path, 'rb')), kind_fmt)
+        if not sources:
+            raise click.UsageError('Give at least one of --users, --habits or --tasks.')
+        try:
+            result = import_data(get_db(), sources, user_id, batch_size)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+    for error in result['errors']:
+        click.echo(error, err=True)
+    click.echo('Imported %d users, %d habits, %d tasks; skipped %d rows; %.1fs (%d rows/s)' % (
+        result['users'], result['habits'], result['tasks'], result['skipped'],
+        result['seconds'], result['rows_per_sec']))
 
 if __name__ == '__main__':
+    schema.migrate(app.config['DATABASE_URL'])
     app.run()
\ No newline at end of file
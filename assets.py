@@ -0,0 +1,217 @@
+# assets.py
+
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+
+from flask import request, send_from_directory, url_for
+
+try:
+    from PIL import Image
+except ImportError:  # image variants are skipped without Pillow
+    Image = None
+
+try:
+    import brotli
+except ImportError:  # only gzip copies are made without brotli
+    brotli = None
+
+# Build output lives under the static folder so the static route serves it
+BUILD_DIR = 'build'
+MANIFEST = 'manifest.json'
+
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt')
+RESIZABLE = ('.png', '.jpg', '.jpeg', '.webp')
+DEFAULT_IMAGE_WIDTHS = (320, 640, 1280)
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+ONE_YEAR = 365 * 24 * 3600
+
+
+def fingerprint(path, data):
+    """css/styles.css -> css/styles.<first 12 hex of sha256>.css"""
+    root, ext = os.path.splitext(path)
+    return '%s.%s%s' % (root, hashlib.sha256(data).hexdigest()[:12], ext)
+
+
+def _write(build_root, path, data):
+    target = os.path.join(build_root, *path.split('/'))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as f:
+        f.write(data)
+
+
+def _compress(build_root, path, data):
+    """Write .gz/.br copies that are smaller than the original; returns their encodings."""
+    encodings = []
+    if brotli is not None:
+        compressed = brotli.compress(data, quality=11)
+        if len(compressed) < len(data):
+            _write(build_root, path + ENCODING_SUFFIXES['br'], compressed)
+            encodings.append('br')
+    compressed = gzip.compress(data, 9, mtime=0)
+    if len(compressed) < len(data):
+        _write(build_root, path + ENCODING_SUFFIXES['gzip'], compressed)
+        encodings.append('gzip')
+    return encodings
+
+
+def _variants(build_root, path, data, widths):
+    """Write WebP copies of an image at each width narrower than it; returns [path, width] pairs."""
+    candidates = []
+    with Image.open(io.BytesIO(data)) as image:
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        root = os.path.splitext(path)[0]
+        for width in sorted(set(widths)):
+            if width >= image.width:
+                continue
+            height = max(round(image.height * width / image.width), 1)
+            buf = io.BytesIO()
+            image.resize((width, height), Image.LANCZOS).save(buf, 'WEBP', quality=80, method=6)
+            variant = fingerprint('%s.%dw.webp' % (root, width), buf.getvalue())
+            _write(build_root, variant, buf.getvalue())
+            candidates.append([BUILD_DIR + '/' + variant, width])
+        width = image.width
+    return candidates, width
+
+
+def build(static_folder, image_widths=None, clean=False, log=None):
+    """Fingerprint every static file into static/build and write its manifest.
+
+    CSS/JS get precompressed .gz (and .br, with brotli installed) copies;
+    images get resized WebP variants (with Pillow installed), at the widths
+    in ``image_widths`` for that file or DEFAULT_IMAGE_WIDTHS. Files from
+    earlier builds are kept, so pages rendered before a deploy still load,
+    unless ``clean`` is set. Returns the manifest.
+    """
+    image_widths = image_widths or {}
+    build_root = os.path.join(static_folder, BUILD_DIR)
+    if log and Image is None:
+        log('Pillow is not installed; skipping image variants')
+    if log and brotli is None:
+        log('brotli is not installed; writing gzip copies only')
+
+    manifest = {'files': {}, 'encodings': {}, 'srcsets': {}}
+    for dirpath, dirnames, filenames in os.walk(static_folder):
+        if os.path.abspath(dirpath) == os.path.abspath(static_folder):
+            dirnames[:] = [d for d in dirnames if d != BUILD_DIR]
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.startswith('.'):
+                continue
+            path = os.path.relpath(os.path.join(dirpath, name), static_folder).replace(os.sep, '/')
+            with open(os.path.join(dirpath, name), 'rb') as f:
+                data = f.read()
+            hashed = fingerprint(path, data)
+            _write(build_root, hashed, data)
+            manifest['files'][path] = BUILD_DIR + '/' + hashed
+
+            ext = os.path.splitext(name)[1].lower()
+            if ext in COMPRESSIBLE:
+                encodings = _compress(build_root, hashed, data)
+                if encodings:
+                    manifest['encodings'][BUILD_DIR + '/' + hashed] = encodings
+            if ext in RESIZABLE and Image is not None:
+                candidates, width = _variants(build_root, path, data, image_widths.get(path, DEFAULT_IMAGE_WIDTHS))
+                if candidates:
+                    manifest['srcsets'][path] = candidates + [[BUILD_DIR + '/' + hashed, width]]
+            if log:
+                log('%s -> %s' % (path, manifest['files'][path]))
+
+    if clean:
+        keep = {MANIFEST}
+        for served in served_files(manifest):
+            relative = served[len(BUILD_DIR) + 1:]
+            keep.add(relative)
+            keep.update(relative + suffix for suffix in ENCODING_SUFFIXES.values())
+        for dirpath, _, filenames in os.walk(build_root):
+            for name in filenames:
+                relative = os.path.relpath(os.path.join(dirpath, name), build_root).replace(os.sep, '/')
+                if relative not in keep:
+                    os.remove(os.path.join(dirpath, name))
+
+    # Written last and atomically, so a running server never sees a manifest
+    # naming files that aren't there yet
+    os.makedirs(build_root, exist_ok=True)
+    manifest_path = os.path.join(build_root, MANIFEST)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return manifest
+
+
+def served_files(manifest):
+    """Every fingerprinted path in the manifest, originals and variants."""
+    files = set(manifest['files'].values())
+    for candidates in manifest['srcsets'].values():
+        files.update(path for path, _ in candidates)
+    return files
+
+
+def manifest_path(static_folder):
+    return os.path.join(static_folder, BUILD_DIR, MANIFEST)
+
+
+def load_manifest(static_folder):
+    try:
+        with open(manifest_path(static_folder)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def init_app(app):
+    """Serve the output of build() if there is one.
+
+    url_for('static', filename=...) then points at the fingerprinted copy,
+    which is served with a year-long immutable Cache-Control and, when the
+    client accepts it, a precompressed body. Templates get
+    static_srcset(filename) for responsive images. Without a build, static
+    files are served as they are.
+    """
+    app.config.setdefault('ASSET_IMAGE_WIDTHS', {})
+    manifest = load_manifest(app.static_folder)
+
+    def static_srcset(filename):
+        candidates = manifest['srcsets'].get(filename) if manifest else None
+        if not candidates:
+            return ''
+        return ', '.join('%s %dw' % (url_for('static', filename=path), width) for path, width in candidates)
+
+    app.jinja_env.globals['static_srcset'] = static_srcset
+    if not manifest:
+        return
+
+    files = manifest['files']
+    encodings = manifest['encodings']
+    immutable = served_files(manifest)
+
+    @app.url_defaults
+    def fingerprinted_static(endpoint, values):
+        if endpoint == 'static' and values.get('filename') in files:
+            values['filename'] = files[values['filename']]
+
+    serve_static = app.view_functions['static']
+
+    def static(filename):
+        if filename not in immutable:
+            return serve_static(filename=filename)
+        served, encoding = filename, None
+        for candidate in encodings.get(filename, ()):
+            if request.accept_encodings[candidate]:
+                served, encoding = filename + ENCODING_SUFFIXES[candidate], candidate
+                break
+        response = send_from_directory(app.static_folder, served, max_age=ONE_YEAR,
+                                       mimetype=mimetypes.guess_type(filename)[0])
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        if encodings.get(filename):
+            response.vary.add('Accept-Encoding')
+        if encoding:
+            response.content_encoding = encoding
+        return response
+
+    app.view_functions['static'] = static
@@ -0,0 +1,351 @@
+# bench/run.py
+
+"""Drive the app's routes under load and report throughput and latency.
+
+Seed the database first (see bench/seed.py), then for example:
+
+    python -m bench.run --target client --duration 10 --concurrency 4
+    python -m bench.run --target gunicorn --workers 4 --concurrency 16 --save main
+    python -m bench.run --target gunicorn --workers 4 --concurrency 16 --compare main
+
+--target client runs requests in-process through Flask's test client;
+--target gunicorn starts a real multi-worker server and talks HTTP to it.
+Results can be saved as named baselines under bench/baselines/ and later
+runs compared against them; the exit status is 1 if any scenario regressed
+by more than --threshold.
+"""
+
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import date, datetime, timedelta
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+SCENARIOS = ['login', 'tasks_week', 'toggle_task', 'habits']
+
+CSRF_INPUT = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+class ClientSession:
+    """One logged-in user talking to the app through Flask's test client."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        return response.status_code, response.get_data(as_text=True)
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpSession:
+    """One logged-in user talking to a running server over HTTP."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect)
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self.opener.open(req, timeout=30) as response:
+                return response.status, response.read().decode()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read().decode()
+
+
+class User:
+    def __init__(self, session, username, task_ids):
+        self.session = session
+        self.username = username
+        self.task_ids = task_ids
+        self.csrf_token = None
+
+    def login(self):
+        if self.csrf_token is None:
+            status, body = self.session.request('GET', '/login')
+            match = CSRF_INPUT.search(body)
+            self.csrf_token = match.group(1) if match else ''
+        return self.session.request('POST', '/login', {
+            'csrf_token': self.csrf_token,
+            'username': self.username,
+            'password': 'bench',
+        })
+
+
+def scenario_login(user, rng):
+    return user.login()
+
+
+def scenario_tasks_week(user, rng):
+    return user.session.request('GET', '/tasks?view=week')
+
+
+def scenario_toggle_task(user, rng):
+    return user.session.request('POST', '/toggle_task/%d?view=week' % rng.choice(user.task_ids))
+
+
+def scenario_habits(user, rng):
+    return user.session.request('GET', '/habits')
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(q * len(sorted_values)), len(sorted_values) - 1)]
+
+
+def load_bench_users(count):
+    """Bench usernames with task ids from the current week to toggle."""
+    from app import app, get_db
+    today = date.today()
+    with app.app_context():
+        with get_db().cursor() as cursor:
+            cursor.execute('''
+                SELECT u.username, array_agg(t.id) AS task_ids
+                FROM users u JOIN tasks t ON t.user_id = u.id
+                WHERE u.username LIKE %s AND t.date BETWEEN %s AND %s
+                GROUP BY u.username
+                ORDER BY u.username
+                LIMIT %s
+            ''', ('bench_user_%', today - timedelta(days=7), today + timedelta(days=7), count))
+            rows = cursor.fetchall()
+    if not rows:
+        sys.exit('No bench users with current tasks found; run python -m bench.seed first.')
+    return [(row['username'], row['task_ids']) for row in rows]
+
+
+def check_habit_counters():
+    """Number of bench habits whose counters disagree with their tasks."""
+    from app import app, get_db
+    with app.app_context():
+        with get_db().cursor() as cursor:
+            cursor.execute('''
+                SELECT count(*) AS mismatches FROM habits h
+                JOIN users u ON u.id = h.user_id
+                LEFT JOIN (
+                    SELECT habit_id, count(*) AS n FROM tasks WHERE completed GROUP BY habit_id
+                ) t ON t.habit_id = h.id
+                LEFT JOIN (
+                    SELECT habit_id, sum(completed) AS n FROM habit_completions GROUP BY habit_id
+                ) hc ON hc.habit_id = h.id
+                WHERE u.username LIKE %s
+                  AND (h.times_completed <> COALESCE(t.n, 0) OR COALESCE(hc.n, 0) <> COALESCE(t.n, 0))
+            ''', ('bench_user_%',))
+            return cursor.fetchone()['mismatches']
+
+
+def run_scenario(name, users, duration, seed):
+    """Hammer one scenario from one thread per user for ``duration`` seconds."""
+    action = globals()['scenario_' + name]
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(user, index):
+        rng = random.Random(seed + index)
+        local_latencies = []
+        local_statuses = {}
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            status, _ = action(user, rng)
+            local_latencies.append(time.perf_counter() - start)
+            local_statuses[status] = local_statuses.get(status, 0) + 1
+        with lock:
+            latencies.extend(local_latencies)
+            for status, n in local_statuses.items():
+                statuses[status] = statuses.get(status, 0) + n
+
+    threads = [threading.Thread(target=worker, args=(user, i)) for i, user in enumerate(users)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    errors = sum(n for status, n in statuses.items() if status >= 400)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'statuses': {str(k): v for k, v in sorted(statuses.items())},
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(workers, port):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--bind', '127.0.0.1:%d' % port,
+         '--log-level', 'warning', 'app:app'],
+        cwd=root)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            sys.exit('gunicorn exited with status %d' % process.returncode)
+        try:
+            with urllib.request.urlopen('http://127.0.0.1:%d/login' % port, timeout=1):
+                return process
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            time.sleep(0.2)
+    process.terminate()
+    sys.exit('gunicorn did not start within 60s')
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    header = '%-14s %9s %9s %9s %9s %7s' % ('scenario', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors')
+    print(header)
+    print('-' * len(header))
+    for name, r in results.items():
+        print('%-14s %9.1f %9.2f %9.2f %9.2f %7d' % (name, r['rps'], r['p50_ms'], r['p95_ms'],
+                                                     r['p99_ms'], r['errors']))
+        if baseline and name in baseline:
+            b = baseline[name]
+            print('%-14s %+8.1f%% %+8.1f%% %+8.1f%% %+8.1f%%' % (
+                '  vs baseline', change(b['rps'], r['rps']), change(b['p50_ms'], r['p50_ms']),
+                change(b['p95_ms'], r['p95_ms']), change(b['p99_ms'], r['p99_ms'])))
+
+
+def change(old, new):
+    return (new - old) / old * 100 if old else 0.0
+
+
+def regressions(results, baseline, threshold):
+    found = []
+    for name, r in results.items():
+        b = baseline.get(name)
+        if not b:
+            continue
+        if change(b['rps'], r['rps']) < -threshold:
+            found.append('%s: throughput down %.1f%%' % (name, -change(b['rps'], r['rps'])))
+        if change(b['p95_ms'], r['p95_ms']) > threshold:
+            found.append('%s: p95 latency up %.1f%%' % (name, change(b['p95_ms'], r['p95_ms'])))
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--target', choices=['client', 'gunicorn'], default='client')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers')
+    parser.add_argument('--concurrency', type=int, default=4, help='simultaneous users')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per scenario')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help='comma-separated subset of: ' + ', '.join(SCENARIOS))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', metavar='NAME', help='save results as baseline NAME')
+    parser.add_argument('--compare', metavar='NAME', help='compare against baseline NAME')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='percent change in req/s or p95 that counts as a regression')
+    args = parser.parse_args(argv)
+
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error('unknown scenarios: ' + ', '.join(sorted(unknown)))
+
+    baseline = None
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, args.compare + '.json')) as f:
+            saved = json.load(f)
+        baseline = saved['results']
+        meta = saved['meta']
+        if (meta['target'], meta['concurrency']) != (args.target, args.concurrency):
+            print('note: baseline %r was taken with target=%s concurrency=%d'
+                  % (args.compare, meta['target'], meta['concurrency']))
+
+    bench_users = load_bench_users(args.concurrency)
+    server = None
+    if args.target == 'gunicorn':
+        port = free_port()
+        server = start_gunicorn(args.workers, port)
+        make_session = lambda: HttpSession('http://127.0.0.1:%d' % port)
+    else:
+        from app import app
+        make_session = lambda: ClientSession(app)
+
+    try:
+        users = []
+        for username, task_ids in bench_users:
+            user = User(make_session(), username, task_ids)
+            status, _ = user.login()
+            if status != 302:
+                sys.exit('Could not log in as %s (status %d)' % (username, status))
+            users.append(user)
+
+        results = {}
+        for name in scenarios:
+            results[name] = run_scenario(name, users, args.duration, args.seed)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print('target=%s concurrency=%d duration=%ss' % (args.target, len(users), args.duration))
+    print_results(results, baseline)
+
+    if 'toggle_task' in results:
+        mismatches = check_habit_counters()
+        print('habit counter check: %s' % ('ok' if not mismatches else '%d habits out of step' % mismatches))
+
+    if args.save:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(os.path.join(BASELINE_DIR, args.save + '.json'), 'w') as f:
+            json.dump({
+                'meta': {
+                    'created': datetime.now().isoformat(timespec='seconds'),
+                    'revision': git_revision(),
+                    'target': args.target,
+                    'workers': args.workers if args.target == 'gunicorn' else None,
+                    'concurrency': len(users),
+                    'duration': args.duration,
+                },
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+        print('Saved baseline %r' % args.save)
+
+    if baseline:
+        found = regressions(results, baseline, args.threshold)
+        for line in found:
+            print('REGRESSION ' + line)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+# bench/seed.py
+
+"""Seed a benchmark database with synthetic users, habits and tasks.
+
+Run from the repository root against a throwaway database:
+
+    export DATABASE_URL=postgresql://localhost/planify_bench
+    flask --app app migrate
+    python -m bench.seed --users 50 --habits 5 --years 3 --tasks-per-day 4
+
+Every seeded user is named bench_user_<n> and has the password "bench".
+--reset removes previously seeded bench users (and only those) first.
+"""
+
+import argparse
+import random
+import string
+import time
+from datetime import date, timedelta
+
+from psycopg2.extras import execute_values
+from werkzeug.security import generate_password_hash
+
+from app import app, get_db, password_hasher, rebuild_habit_progress
+
+USERNAME_PREFIX = 'bench_user_'
+PASSWORD = 'bench'
+PERIODS = ['day', 'week', 'month', 'year']
+
+
+def reset(conn):
+    with conn.cursor() as cursor:
+        cursor.execute('SELECT id FROM users WHERE username LIKE %s', (USERNAME_PREFIX + '%',))
+        user_ids = [row['id'] for row in cursor.fetchall()]
+        if user_ids:
+            cursor.execute('DELETE FROM tasks WHERE user_id = ANY(%s)', (user_ids,))
+            cursor.execute('DELETE FROM habits WHERE user_id = ANY(%s)', (user_ids,))
+            cursor.execute('DELETE FROM users WHERE id = ANY(%s)', (user_ids,))
+    conn.commit()
+    return len(user_ids)
+
+
+def random_name(rng, words=2):
+    return ' '.join(''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 9)))
+                    for _ in range(words)).capitalize()
+
+
+def seed(conn, users, habits, years, tasks_per_day, undated, rng):
+    today = date.today()
+    # One hash shared by every bench user, made with the app's current method
+    # so logins don't trigger a rehash
+    password_hash = generate_password_hash(PASSWORD, password_hasher.method)
+
+    with conn.cursor() as cursor:
+        cursor.execute('SELECT count(*) AS n FROM users WHERE username LIKE %s', (USERNAME_PREFIX + '%',))
+        offset = cursor.fetchone()['n']
+        user_ids = [row['id'] for row in execute_values(
+            cursor,
+            'INSERT INTO users (username, password) VALUES %s RETURNING id',
+            [(USERNAME_PREFIX + str(offset + i), password_hash) for i in range(users)],
+            fetch=True)]
+
+        habit_rows = execute_values(
+            cursor,
+            'INSERT INTO habits (user_id, name, frequency, period, times_completed) VALUES %s RETURNING id, user_id',
+            [(user_id, random_name(rng), rng.randint(1, 7), rng.choice(PERIODS), 0)
+             for user_id in user_ids for _ in range(habits)],
+            fetch=True)
+        habits_by_user = {}
+        for row in habit_rows:
+            habits_by_user.setdefault(row['user_id'], []).append(row['id'])
+
+        first_day = today - timedelta(days=int(years * 365))
+        last_day = today + timedelta(days=7)
+        task_count = 0
+        for user_id in user_ids:
+            user_habits = habits_by_user.get(user_id, [])
+            rows = []
+            day = first_day
+            while day <= last_day:
+                for _ in range(int(tasks_per_day) + (rng.random() < tasks_per_day % 1)):
+                    habit_id = rng.choice(user_habits) if user_habits and rng.random() < 0.6 else None
+                    completed = day <= today and rng.random() < 0.7
+                    rows.append((user_id, habit_id, random_name(rng, 3), None, day, completed,
+                                 day if completed else None))
+                day += timedelta(days=1)
+            for _ in range(undated):
+                rows.append((user_id, None, random_name(rng, 3), None, None, False, None))
+            execute_values(
+                cursor,
+                'INSERT INTO tasks (user_id, habit_id, name, description, date, completed, completed_on) VALUES %s',
+                rows, page_size=10000)
+            task_count += len(rows)
+
+        cursor.execute('''
+            UPDATE habits h SET times_completed = c.n
+            FROM (
+                SELECT habit_id, count(*) AS n FROM tasks
+                WHERE user_id = ANY(%s) AND habit_id IS NOT NULL AND completed
+                GROUP BY habit_id
+            ) c
+            WHERE h.id = c.habit_id
+        ''', (user_ids,))
+
+    habit_ids = [row['id'] for row in habit_rows]
+    for i in range(0, len(habit_ids), 500):
+        rebuild_habit_progress(conn, habit_ids[i:i + 500])
+    conn.commit()
+    return len(user_ids), len(habit_ids), task_count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--habits', type=int, default=5, help='habits per user')
+    parser.add_argument('--years', type=float, default=2, help='years of dated task history per user')
+    parser.add_argument('--tasks-per-day', type=float, default=3, help='average dated tasks per user per day')
+    parser.add_argument('--undated', type=int, default=20, help='undated tasks per user')
+    parser.add_argument('--seed', type=int, default=1, help='random seed, for reproducible data')
+    parser.add_argument('--reset', action='store_true', help='delete existing bench users first')
+    args = parser.parse_args(argv)
+
+    with app.app_context():
+        conn = get_db()
+        if args.reset:
+            print('Removed %d bench users' % reset(conn))
+        start = time.perf_counter()
+        users, habits, tasks = seed(conn, args.users, args.habits, args.years, args.tasks_per_day,
+                                    args.undated, random.Random(args.seed))
+        print('Seeded %d users, %d habits, %d tasks in %.1fs'
+              % (users, habits, tasks, time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+# bench/startup.py
+
+"""Measure how long a fresh process takes to import the app and serve.
+
+    python -m bench.startup --runs 10
+
+Each run starts a new interpreter, as a gunicorn worker or flask CLI call
+would, and reports the time to import app.py and the time from there to
+the first response to GET /login.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PROBE = '''
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.app.test_client().get('/login')
+served = time.perf_counter()
+print(json.dumps({'import': imported - start, 'first_request': served - imported}))
+'''
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    samples = []
+    for _ in range(args.runs):
+        output = subprocess.check_output([sys.executable, '-c', PROBE], cwd=root, text=True)
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+
+    for key in ('import', 'first_request'):
+        values = sorted(s[key] * 1000 for s in samples)
+        print('%-14s median %7.1f ms   min %7.1f ms   max %7.1f ms'
+              % (key, statistics.median(values), values[0], values[-1]))
+
+
+if __name__ == '__main__':
+    main()
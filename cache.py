@@ -0,0 +1,83 @@
+# cache.py
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Bounded in-process cache with per-entry expiry and LRU eviction.
+
+    Each gunicorn worker holds its own copy, so entries must be safe to serve
+    slightly stale for up to ``ttl`` seconds. If ``weigh`` is given, the total
+    weight of the entries (e.g. their length in characters) is also kept
+    under ``maxweight``.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300, weigh=None, maxweight=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.weigh = weigh
+        self.maxweight = maxweight
+        self.weight = 0
+        self._data = OrderedDict()  # key -> (expires_at, value, weight)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                self._remove(key)
+            self.misses += 1
+            return default
+
+    def _remove(self, key):
+        # Caller holds the lock.
+        entry = self._data.pop(key)
+        self.weight -= entry[2]
+        return entry
+
+    def set(self, key, value):
+        weight = self.weigh(value) if self.weigh else 0
+        if self.maxsize <= 0 or (self.maxweight is not None and weight > self.maxweight):
+            return
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (time.monotonic() + self.ttl, value, weight)
+            self.weight += weight
+            while len(self._data) > self.maxsize or (
+                    self.maxweight is not None and self.weight > self.maxweight):
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            return self._remove(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._data),
+                'weight': self.weight,
+            }
@@ -0,0 +1,221 @@
+# db.py
+
+import os
+import threading
+import time
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.extras import RealDictCursor
+from flask import current_app, g
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be checked out within the timeout."""
+
+
+class ConnectionPool:
+    """Thread-safe Postgres connection pool.
+
+    Connections are opened lazily up to ``maxconn``; idle ones above
+    ``minconn`` are closed after ``idle_timeout`` seconds. A connection that
+    has been idle longer than ``check_after`` seconds is pinged before being
+    handed out so a dropped server connection never reaches a route.
+    """
+
+    def __init__(self, dsn, minconn=1, maxconn=10, idle_timeout=300,
+                 timeout=30, check_after=30, cursor_factory=RealDictCursor):
+        self.dsn = dsn
+        self.cursor_factory = cursor_factory
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.check_after = check_after
+        self.pid = os.getpid()
+
+        self._idle = []  # (connection, returned_at), most recently used last
+        self._size = 0  # open connections, idle or checked out
+        self._cond = threading.Condition()
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'timeouts': 0,
+            'connects': 0,
+            'discarded': 0,
+        }
+
+    def _connect(self):
+        return psycopg2.connect(self.dsn, cursor_factory=self.cursor_factory)
+
+    def _discard(self, conn):
+        # Caller holds the lock.
+        self._size -= 1
+        self._stats['discarded'] += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _prune(self, now):
+        # Close connections that sat idle too long, oldest first, never
+        # dropping below minconn. Caller holds the lock.
+        while (self._idle and self._size > self.minconn
+               and now - self._idle[0][1] > self.idle_timeout):
+            conn, _ = self._idle.pop(0)
+            self._discard(conn)
+
+    def _healthy(self, conn, returned_at, now):
+        if conn.closed:
+            return False
+        if now - returned_at < self.check_after:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        waited = None
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    self._prune(now)
+                    if self._idle:
+                        conn, returned_at = self._idle.pop()
+                        if conn.closed:
+                            self._discard(conn)
+                            continue
+                        break
+                    if self._size < self.maxconn:
+                        # Reserve the slot, then connect without holding the lock.
+                        self._size += 1
+                        conn = None
+                        break
+                    if waited is None:
+                        waited = now
+                        self._stats['waits'] += 1
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        self._stats['wait_time'] += now - waited
+                        raise PoolTimeout('No database connection available after %ss' % self.timeout)
+                    self._cond.wait(remaining)
+
+            # Ping outside the lock too, so a slow server can't hold up
+            # other threads' checkouts or their timeouts.
+            if conn is None or self._healthy(conn, returned_at, now):
+                break
+            with self._cond:
+                self._discard(conn)
+                self._cond.notify()
+
+        with self._cond:
+            self._stats['checkouts'] += 1
+            if waited is not None:
+                self._stats['wait_time'] += time.monotonic() - waited
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._stats['connects'] += 1
+        return conn
+
+    def putconn(self, conn):
+        with self._cond:
+            status = None
+            if not conn.closed:
+                status = conn.get_transaction_status()
+                if status in (extensions.TRANSACTION_STATUS_INTRANS,
+                              extensions.TRANSACTION_STATUS_INERROR):
+                    # A route bailed out mid-transaction; don't leak it.
+                    try:
+                        conn.rollback()
+                        status = conn.get_transaction_status()
+                    except psycopg2.Error:
+                        status = None
+            if status == extensions.TRANSACTION_STATUS_IDLE:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self._discard(conn)
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['size'] = self._size
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._size - len(self._idle)
+            return stats
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return this process's pool, creating it on first use.
+
+    gunicorn forks workers after import, so a pool inherited from the parent
+    is dropped rather than shared across processes.
+    """
+    global _pool
+    pool = _pool
+    if pool is not None and pool.pid == os.getpid():
+        return pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            config = current_app.config
+            _pool = ConnectionPool(
+                config['DATABASE_URL'],
+                minconn=config['DB_POOL_MIN'],
+                maxconn=config['DB_POOL_MAX'],
+                idle_timeout=config['DB_POOL_IDLE_TIMEOUT'],
+                timeout=config['DB_POOL_TIMEOUT'],
+                check_after=config['DB_POOL_CHECK_AFTER'],
+                cursor_factory=config.get('DB_CURSOR_FACTORY', RealDictCursor),
+            )
+        return _pool
+
+
+def get_db():
+    """Borrow one connection for the current app context."""
+    if 'db_conn' not in g:
+        start = time.perf_counter()
+        g.db_conn = get_pool().getconn()
+        g.db_checkout_time = time.perf_counter() - start
+    return g.db_conn
+
+
+def release_db(exception=None):
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        get_pool().putconn(conn)
+
+
+def init_app(app):
+    app.config.setdefault('DATABASE_URL', os.environ.get('DATABASE_URL'))
+    app.config.setdefault('DB_POOL_MIN', int(os.environ.get('DB_POOL_MIN', 1)))
+    app.config.setdefault('DB_POOL_MAX', int(os.environ.get('DB_POOL_MAX', 10)))
+    app.config.setdefault('DB_POOL_IDLE_TIMEOUT', float(os.environ.get('DB_POOL_IDLE_TIMEOUT', 300)))
+    app.config.setdefault('DB_POOL_TIMEOUT', float(os.environ.get('DB_POOL_TIMEOUT', 30)))
+    app.config.setdefault('DB_POOL_CHECK_AFTER', float(os.environ.get('DB_POOL_CHECK_AFTER', 30)))
+    app.teardown_appcontext(release_db)
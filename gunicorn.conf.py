@@ -0,0 +1,27 @@
+# gunicorn.conf.py
+
+import os
+
+# Load the app once in the master and apply pending migrations there before
+# forking, so workers start serving without running any DDL of their own.
+preload_app = True
+
+# Threaded workers, so requests waiting on a password hash don't hold up the
+# rest of the worker's requests. Keep threads at or below DB_POOL_MAX.
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Each worker runs its own password hashing pool: one process per worker
+# keeps the total at one per worker rather than a multiple of it, and
+# capping pending hashes below the thread count leaves threads free for
+# other requests while logins get fast 429s. Read when the app is loaded.
+os.environ.setdefault('PASSWORD_HASH_WORKERS', '1')
+os.environ.setdefault('PASSWORD_HASH_MAX_PENDING', str(max(threads // 2, 1)))
+
+
+def on_starting(server):
+    import schema
+    from app import app
+
+    applied = schema.migrate(app.config['DATABASE_URL'], log=server.log.info)
+    server.log.info('Schema up to date (%d migrations applied)', len(applied))
@@ -0,0 +1,131 @@
+# hashing.py
+
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class HasherBusy(Exception):
+    """Raised when the hashing queue is full; the caller should ask the user to retry."""
+
+
+class PasswordHasher:
+    """Runs password hashing on a bounded pool of worker processes.
+
+    PBKDF2 is deliberately slow, so hashing inline would stall every other
+    request on the web worker. At most ``max_pending`` hashes may be queued
+    or running at once; beyond that calls fail fast with HasherBusy. The
+    limit only bites when the web worker serves requests concurrently (see
+    gunicorn.conf.py). With ``workers=0`` hashing runs inline (still subject
+    to the limit).
+    """
+
+    def __init__(self, workers=2, max_pending=8, iterations=600000, timeout=10):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.method = 'pbkdf2:sha256:%d' % iterations
+        self.timeout = timeout
+
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._stats = {
+            'hashes': 0,
+            'verifies': 0,
+            'rejected': 0,
+            'timeouts': 0,
+            'latency_sum': 0.0,
+            'latency_max': 0.0,
+        }
+
+    def _get_executor(self):
+        # Worker processes don't survive a fork, so each gunicorn worker
+        # starts its own pool on first use. Its children come from a
+        # forkserver rather than a fork of this threaded process, which could
+        # hand them a lock another thread was holding.
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('forkserver'))
+                self._pid = os.getpid()
+            return self._executor
+
+    def _reset_executor(self):
+        with self._lock:
+            self._executor = None
+
+    def _run(self, kind, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise HasherBusy('Password hashing queue is full')
+        with self._lock:
+            self._in_flight += 1
+        start = time.perf_counter()
+        try:
+            if not self.workers:
+                try:
+                    return fn(*args)
+                finally:
+                    self._slots.release()
+            try:
+                future = self._get_executor().submit(fn, *args)
+            except BaseException:
+                self._slots.release()
+                raise
+            # The slot is only freed once the job leaves the pool, so a
+            # caller that gives up waiting can't let the queue overfill
+            future.add_done_callback(lambda _: self._slots.release())
+            try:
+                return future.result(timeout=self.timeout)
+            except FutureTimeout:
+                future.cancel()
+                with self._lock:
+                    self._stats['timeouts'] += 1
+                raise HasherBusy('Password hashing timed out')
+            except BrokenProcessPool:
+                self._reset_executor()
+                raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._in_flight -= 1
+                self._stats[kind] += 1
+                self._stats['latency_sum'] += elapsed
+                self._stats['latency_max'] = max(self._stats['latency_max'], elapsed)
+
+    def hash(self, password):
+        return self._run('hashes', generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        return self._run('verifies', check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True if the hash was made with a different method or work factor."""
+        return pwhash.split('$', 1)[0] != self.method
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = self._in_flight
+        return stats
+
+
+def init_app(app):
+    app.config.setdefault('PASSWORD_HASH_WORKERS', int(os.environ.get('PASSWORD_HASH_WORKERS', 2)))
+    app.config.setdefault('PASSWORD_HASH_MAX_PENDING', int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 8)))
+    app.config.setdefault('PASSWORD_HASH_ITERATIONS', int(os.environ.get('PASSWORD_HASH_ITERATIONS', 600000)))
+    app.config.setdefault('PASSWORD_HASH_TIMEOUT', float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10)))
+    return PasswordHasher(
+        workers=app.config['PASSWORD_HASH_WORKERS'],
+        max_pending=app.config['PASSWORD_HASH_MAX_PENDING'],
+        iterations=app.config['PASSWORD_HASH_ITERATIONS'],
+        timeout=app.config['PASSWORD_HASH_TIMEOUT'],
+    )
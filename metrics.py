@@ -0,0 +1,253 @@
+# metrics.py
+
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from flask import Response, abort, g, has_request_context, request, before_render_template, template_rendered
+from psycopg2.extras import RealDictCursor
+
+
+class RollingHistogram:
+    """Latency samples over a sliding window, plus lifetime count and sum."""
+
+    def __init__(self, window=1024):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        with self._lock:
+            self._samples.append(value)
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self, quantiles=(0.5, 0.95, 0.99)):
+        with self._lock:
+            samples = sorted(self._samples)
+            count, total = self.count, self.sum
+        values = {}
+        for q in quantiles:
+            values[q] = samples[min(int(q * len(samples)), len(samples) - 1)] if samples else 0.0
+        return values, count, total
+
+
+class RequestMetrics:
+    """Timings collected while handling one request."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}  # name -> seconds
+        self.sql_count = 0
+        self.render_stack = []
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+
+_lock = threading.Lock()
+_endpoint_histograms = {}
+_sql_histograms = {}
+_collectors = {}
+_window = 1024
+
+# Statements beyond this many distinct labels are counted under "other"
+MAX_SQL_LABELS = 500
+
+_WHITESPACE = re.compile(r'\s+')
+_VALUES_LIST = re.compile(r'\bVALUES\s*\(.*', re.IGNORECASE | re.DOTALL)
+
+
+def normalize_sql(query, vars=None):
+    """Collapse whitespace so one statement always gets the same label.
+
+    Statements run with parameters are free of literals already. Bytes with
+    no parameters come from execute_values, which inlines each batch's rows;
+    their VALUES list is dropped so every batch shares one label.
+    """
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+        if vars is None:
+            query = _VALUES_LIST.sub('VALUES ...', query)
+    elif not isinstance(query, str):
+        query = query.as_string(None) if hasattr(query, 'as_string') else str(query)
+    return _WHITESPACE.sub(' ', query).strip()[:200]
+
+
+def _histogram(table, key, limit=None):
+    histogram = table.get(key)
+    if histogram is None:
+        with _lock:
+            if limit is not None and key not in table and len(table) >= limit:
+                key = 'other'
+            histogram = table.setdefault(key, RollingHistogram(_window))
+    return histogram
+
+
+def _current():
+    if has_request_context():
+        return g.get('metrics')
+    return None
+
+
+@contextmanager
+def timed(phase):
+    """Add the time spent in the block to the current request's ``phase``."""
+    current = _current()
+    if current is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        current.add(phase, time.perf_counter() - start)
+
+
+class InstrumentedCursor(RealDictCursor):
+    """RealDictCursor that times every statement run during a request."""
+
+    def execute(self, query, vars=None):
+        current = _current()
+        if current is None:
+            return super().execute(query, vars)
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            elapsed = time.perf_counter() - start
+            current.add('sql', elapsed)
+            current.sql_count += 1
+            _histogram(_sql_histograms, normalize_sql(query, vars), MAX_SQL_LABELS).observe(elapsed)
+
+
+def register_collector(name, collect):
+    """Export the dict returned by ``collect()`` as gauges named planify_<name>_<key>."""
+    _collectors[name] = collect
+
+
+def _before_request():
+    g.metrics = RequestMetrics()
+
+
+def _before_render(sender, template, context, **extra):
+    current = _current()
+    if current is not None:
+        current.render_stack.append(time.perf_counter())
+
+
+def _after_render(sender, template, context, **extra):
+    current = _current()
+    if current is not None and current.render_stack:
+        start = current.render_stack.pop()
+        # Only the outermost template counts; nested includes are part of it
+        if not current.render_stack:
+            current.add('render', time.perf_counter() - start)
+
+
+def _after_request(response):
+    # A streamed body is generated after this hook, so its request keeps
+    # collecting (renders, queries) until the stream ends
+    current = g.get('metrics') if response.is_streamed else g.pop('metrics', None)
+    if current is None:
+        return response
+    checkout = g.get('db_checkout_time')
+    if checkout is not None:
+        current.add('db-connect', checkout)
+    total = time.perf_counter() - current.start
+    histogram = _histogram(_endpoint_histograms, request.endpoint or 'unmatched')
+    if response.is_streamed:
+        # Headers go out first, so Server-Timing covers only the work done
+        # before streaming; the endpoint latency is taken once the body is sent
+        response.call_on_close(lambda: histogram.observe(time.perf_counter() - current.start))
+    else:
+        histogram.observe(total)
+
+    timings = []
+    for phase, seconds in current.phases.items():
+        entry = '%s;dur=%.2f' % (phase, seconds * 1000)
+        if phase == 'sql':
+            entry += ';desc="%d statements"' % current.sql_count
+        timings.append(entry)
+    timings.append('total;dur=%.2f' % (total * 1000))
+    response.headers.add('Server-Timing', ', '.join(timings))
+    return response
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _summary(lines, name, help_text, label, histograms):
+    lines.append('# HELP %s %s' % (name, help_text))
+    lines.append('# TYPE %s summary' % name)
+    pid = os.getpid()
+    for key, histogram in sorted(histograms.items()):
+        values, count, total = histogram.snapshot()
+        labels = '%s="%s",pid="%d"' % (label, _escape(key), pid)
+        for q, value in values.items():
+            lines.append('%s{%s,quantile="%s"} %.6f' % (name, labels, q, value))
+        lines.append('%s_count{%s} %d' % (name, labels, count))
+        lines.append('%s_sum{%s} %.6f' % (name, labels, total))
+
+
+def render_prometheus():
+    lines = []
+    _summary(lines, 'planify_request_duration_seconds', 'Request latency by endpoint.',
+             'endpoint', dict(_endpoint_histograms))
+    _summary(lines, 'planify_sql_duration_seconds', 'SQL statement latency by normalized text.',
+             'statement', dict(_sql_histograms))
+    for name, collect in sorted(_collectors.items()):
+        try:
+            stats = collect()
+        except Exception:
+            continue
+        for key, value in sorted(stats.items()):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                metric = 'planify_%s_%s' % (name, key)
+                lines.append('# TYPE %s gauge' % metric)
+                lines.append('%s{pid="%d"} %s' % (metric, os.getpid(), value))
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app):
+    """Enable instrumentation if METRICS_ENABLED is set.
+
+    Timings are kept per worker process; /metrics reports the worker that
+    served the scrape, labelled with its pid. It requires
+    ``Authorization: Bearer $METRICS_TOKEN`` and is off (404) without one.
+
+    For streamed responses (the tasks page) the Server-Timing header only
+    covers the work done before the body starts; the endpoint latency in
+    /metrics includes the whole stream.
+    """
+    global _window
+    app.config.setdefault('METRICS_ENABLED', os.environ.get('METRICS_ENABLED', '').lower() in ('1', 'true', 'yes'))
+    app.config.setdefault('METRICS_TOKEN', os.environ.get('METRICS_TOKEN'))
+    app.config.setdefault('METRICS_WINDOW', int(os.environ.get('METRICS_WINDOW', 1024)))
+    if not app.config['METRICS_ENABLED']:
+        return
+    _window = app.config['METRICS_WINDOW']
+    app.config['DB_CURSOR_FACTORY'] = InstrumentedCursor
+
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+
+    @app.route('/metrics')
+    def metrics():
+        # Behind a reverse proxy every client looks local, so there is no
+        # unauthenticated fallback
+        token = app.config['METRICS_TOKEN']
+        if not token:
+            abort(404)
+        if request.headers.get('Authorization') != 'Bearer ' + token:
+            abort(401)
+        # Scrapes shouldn't skew the endpoint latencies they report
+        g.pop('metrics', None)
+        return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,28 @@
+-- migrations/0001_initial.sql
+-- IF NOT EXISTS throughout so databases set up before migrations existed
+-- are adopted as they are.
+
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    username VARCHAR(150) NOT NULL UNIQUE,
+    password VARCHAR(255) NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS habits (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    name VARCHAR(150) NOT NULL,
+    frequency INTEGER NOT NULL,
+    period VARCHAR(20) NOT NULL,
+    times_completed INTEGER DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS tasks (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    habit_id INTEGER REFERENCES habits(id),
+    name VARCHAR(150) NOT NULL,
+    description TEXT,
+    date DATE,
+    completed BOOLEAN DEFAULT FALSE
+);
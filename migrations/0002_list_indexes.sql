@@ -0,0 +1,9 @@
+-- migrations/0002_list_indexes.sql
+
+CREATE INDEX IF NOT EXISTS tasks_user_date_idx ON tasks (user_id, date);
+CREATE INDEX IF NOT EXISTS habits_user_idx ON habits (user_id);
+
+-- Keyset pages of the to-do list walk (user_id, id); replaces an earlier
+-- index on (user_id) alone
+DROP INDEX IF EXISTS tasks_user_undated_idx;
+CREATE INDEX IF NOT EXISTS tasks_user_undated_id_idx ON tasks (user_id, id) WHERE date IS NULL;
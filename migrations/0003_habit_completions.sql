@@ -0,0 +1,14 @@
+-- migrations/0003_habit_completions.sql
+-- After applying to a database with existing tasks, run
+-- `flask backfill-habit-progress` to fill habit_completions.
+
+-- Day a task was last marked completed; buckets undated tasks
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS completed_on DATE;
+
+-- Completed tasks per habit per period (day/week/month/year)
+CREATE TABLE IF NOT EXISTS habit_completions (
+    habit_id INTEGER NOT NULL REFERENCES habits(id) ON DELETE CASCADE,
+    period_start DATE NOT NULL,
+    completed INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (habit_id, period_start)
+);
@@ -0,0 +1,4 @@
+-- migrations/0004_data_version.sql
+
+-- Bumped on every habit/task write; drives ETags and fragment keys
+ALTER TABLE users ADD COLUMN IF NOT EXISTS data_version BIGINT NOT NULL DEFAULT 0;
@@ -0,0 +1,10 @@
+-- migrations/0005_habit_occurrences.sql
+
+-- Habit occurrences the scheduler has created a task for, so each is
+-- created once even if the task is later moved or deleted
+CREATE TABLE IF NOT EXISTS habit_occurrences (
+    habit_id INTEGER NOT NULL REFERENCES habits(id) ON DELETE CASCADE,
+    period_start DATE NOT NULL,
+    occurrence INTEGER NOT NULL,
+    PRIMARY KEY (habit_id, period_start, occurrence)
+);
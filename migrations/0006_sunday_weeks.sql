@@ -0,0 +1,29 @@
+-- migrations/0006_sunday_weeks.sql
+
+-- Weekly habits are now bucketed Sunday to Saturday, like the tasks page's
+-- Week view, instead of by Monday-based ISO weeks. Rebuild their buckets.
+UPDATE tasks t SET completed_on = COALESCE(t.date, CURRENT_DATE)
+FROM habits h
+WHERE t.habit_id = h.id AND h.period = 'week' AND t.completed AND t.completed_on IS NULL;
+
+DELETE FROM habit_completions hc USING habits h
+WHERE hc.habit_id = h.id AND h.period = 'week';
+
+INSERT INTO habit_completions (habit_id, period_start, completed)
+SELECT h.id,
+       (date_trunc('week', COALESCE(t.date, t.completed_on)::timestamp + interval '1 day')
+        - interval '1 day')::date,
+       count(*)
+FROM tasks t
+JOIN habits h ON h.id = t.habit_id AND h.user_id = t.user_id
+WHERE h.period = 'week' AND t.completed
+GROUP BY 1, 2;
+
+-- Keep the scheduler's claims on the weeks already scheduled, so it doesn't
+-- create their tasks a second time under the new week starts
+UPDATE habit_occurrences o SET period_start = o.period_start - 1
+FROM habits h
+WHERE o.habit_id = h.id AND h.period = 'week' AND extract(isodow FROM o.period_start) = 1;
+
+UPDATE users SET data_version = data_version + 1
+WHERE id IN (SELECT user_id FROM habits WHERE period = 'week');
@@ -0,0 +1,9 @@
+-- migrations/0007_occurrence_tasks.sql
+
+-- The task the scheduler created for each occurrence, so deleting a habit
+-- can remove exactly those. Claims outlive their tasks so a deleted task
+-- isn't scheduled again. Occurrences claimed before this migration stay NULL.
+ALTER TABLE habit_occurrences
+    ADD COLUMN IF NOT EXISTS task_id INTEGER REFERENCES tasks(id) ON DELETE SET NULL;
+
+CREATE INDEX IF NOT EXISTS habit_occurrences_task_idx ON habit_occurrences (task_id);
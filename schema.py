@@ -0,0 +1,99 @@
+# schema.py
+
+import os
+import re
+
+import psycopg2
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+# pg_advisory_lock key shared by every process that migrates, so concurrent
+# deploys apply each migration exactly once
+LOCK_KEY = 0x706C616E6966  # "planif"
+
+_FILENAME = re.compile(r'^(\d+)_(\w+)\.sql$')
+
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    """(version, name, path) for each NNNN_name.sql file, in version order."""
+    migrations = {}
+    for filename in os.listdir(directory):
+        match = _FILENAME.match(filename)
+        if not match:
+            continue
+        version = int(match.group(1))
+        if version in migrations:
+            raise ValueError('Two migrations numbered %d in %s' % (version, directory))
+        migrations[version] = (version, match.group(2), os.path.join(directory, filename))
+    return [migrations[v] for v in sorted(migrations)]
+
+
+def _applied_versions(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    ''')
+    cursor.execute('SELECT version FROM schema_migrations')
+    return {row[0] for row in cursor.fetchall()}
+
+
+def migrate(dsn, directory=MIGRATIONS_DIR, log=None):
+    """Apply pending migrations in order; returns the (version, name) pairs applied.
+
+    Uses its own connection rather than the app's pool, so a gunicorn
+    master can migrate without leaving connections for workers to inherit.
+    Each migration commits on its own; a failure stops the run with the
+    earlier ones kept.
+    """
+    migrations = load_migrations(directory)
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_lock(%s)', (LOCK_KEY,))
+        conn.commit()
+        try:
+            with conn.cursor() as cursor:
+                # Read after taking the lock, in case another process just migrated
+                applied = _applied_versions(cursor)
+            conn.commit()
+            done = []
+            for version, name, path in migrations:
+                if version in applied:
+                    continue
+                with open(path) as f:
+                    statements = f.read()
+                if log:
+                    log('Applying migration %04d_%s' % (version, name))
+                with conn.cursor() as cursor:
+                    cursor.execute(statements)
+                    cursor.execute('INSERT INTO schema_migrations (version, name) VALUES (%s, %s)',
+                                   (version, name))
+                conn.commit()
+                done.append((version, name))
+            return done
+        finally:
+            conn.rollback()
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_unlock(%s)', (LOCK_KEY,))
+            conn.commit()
+    finally:
+        conn.close()
+
+
+def status(dsn, directory=MIGRATIONS_DIR):
+    """(version, name, applied) for every migration file."""
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+            if cursor.fetchone()[0]:
+                cursor.execute('SELECT version FROM schema_migrations')
+                applied = {row[0] for row in cursor.fetchall()}
+            else:
+                applied = set()
+        return [(version, name, version in applied) for version, name, _ in load_migrations(directory)]
+    finally:
+        conn.close()
@@ -1,31 +0,0 @@
--- schema.sql
-DROP TABLE IF EXISTS users;
-CREATE TABLE users (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    username TEXT NOT NULL UNIQUE,
-    password TEXT NOT NULL
-);
-
-DROP TABLE IF EXISTS habits;
-CREATE TABLE habits (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id INTEGER NOT NULL,
-    name TEXT NOT NULL,
-    frequency INTEGER NOT NULL,
-    period TEXT NOT NULL,
-    times_completed INTEGER DEFAULT 0,
-    FOREIGN KEY (user_id) REFERENCES users (id)
-);
-
-DROP TABLE IF EXISTS tasks;
-CREATE TABLE tasks (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id INTEGER NOT NULL,
-    habit_id INTEGER,
-    name TEXT NOT NULL,
-    description TEXT,
-    date DATE,
-    completed BOOLEAN DEFAULT 0,
-    FOREIGN KEY (user_id) REFERENCES users (id),
-    FOREIGN KEY (habit_id) REFERENCES habits (id)
-);
\ No newline at end of file
@@ -1,11 +1,136 @@
 // static/js/scripts.js
 
-// JavaScript code to handle habit selection and view switching is already included in the tasks.html template
-// If you have more JavaScript code, you can include it here
-
-// Example: Implementing view switching logic (this is a placeholder)
-function showView(viewType) {
-    // Implement the logic to filter and display tasks based on the selected view type
-    // For example, you could use AJAX to fetch tasks for the selected date range
-    console.log('View type ' + viewType + ' selected.');
-}
\ No newline at end of file
+// Tasks page: toggle, delete and edit tasks through the JSON API and apply
+// the result in place instead of reloading the whole page. The plain form
+// POSTs in tasks.html still work if this script fails to load.
+
+const API_BASE = '/api/v1';
+
+function csrfToken() {
+    const meta = document.querySelector('meta[name="csrf-token"]');
+    return meta ? meta.content : '';
+}
+
+function apiRequest(method, path, body) {
+    return fetch(API_BASE + path, {
+        method: method,
+        credentials: 'same-origin',
+        headers: {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': csrfToken()
+        },
+        body: body === undefined ? undefined : JSON.stringify(body)
+    }).then(function(response) {
+        return response.json().then(function(data) {
+            if (!response.ok) {
+                throw data;
+            }
+            return data;
+        });
+    });
+}
+
+function updateStatusButtons(task) {
+    document.querySelectorAll('.toggle-task-form[data-task-id="' + task.id + '"] .status-btn').forEach(function(button) {
+        button.classList.toggle('completed', task.completed);
+        button.classList.toggle('incomplete', !task.completed);
+        button.textContent = task.completed ? 'Completed' : 'Complete';
+    });
+}
+
+function updateHabitRemaining(habit) {
+    document.querySelectorAll('.habit-remaining[data-habit-id="' + habit.id + '"]').forEach(function(element) {
+        element.textContent = habit.remaining + ' remaining';
+    });
+}
+
+function removeTaskItem(taskId) {
+    document.querySelectorAll('.toggle-task-form[data-task-id="' + taskId + '"]').forEach(function(form) {
+        const item = form.closest('li');
+        const list = item.parentElement;
+        item.remove();
+        if (!list.querySelector('li') && list.dataset.emptyText) {
+            const placeholder = document.createElement('li');
+            placeholder.textContent = list.dataset.emptyText;
+            list.appendChild(placeholder);
+        }
+    });
+}
+
+function reportError(error) {
+    console.error('Task update failed:', error);
+    alert((error && error.error) || 'Something went wrong. Please reload the page.');
+}
+
+document.querySelectorAll('.toggle-task-form').forEach(function(form) {
+    form.addEventListener('submit', function(event) {
+        event.preventDefault();
+        apiRequest('POST', '/tasks/' + form.dataset.taskId + '/toggle')
+            .then(function(data) {
+                updateStatusButtons(data.task);
+                if (data.habit) {
+                    updateHabitRemaining(data.habit);
+                }
+            })
+            .catch(reportError);
+    });
+});
+
+document.querySelectorAll('.delete-task-form').forEach(function(form) {
+    form.addEventListener('submit', function(event) {
+        event.preventDefault();
+        apiRequest('DELETE', '/tasks/' + form.dataset.taskId)
+            .then(function(data) {
+                removeTaskItem(data.deleted);
+                if (data.habit) {
+                    updateHabitRemaining(data.habit);
+                }
+            })
+            .catch(reportError);
+    });
+});
+
+// Saving an edited task: update the name in place when the task stays on
+// the same day, otherwise reload the current view so it lands in the right card
+document.querySelectorAll('.task-form').forEach(function(form) {
+    const taskIdInput = form.querySelector('input[name="task_id"]');
+    if (!taskIdInput) {
+        return;
+    }
+    form.addEventListener('submit', function(event) {
+        if (!form.contains(taskIdInput)) {
+            return;  // Editing finished; later submits create new tasks as usual
+        }
+        event.preventDefault();
+        const taskId = taskIdInput.value;
+        const originalDate = form.dataset.taskDate || null;
+        apiRequest('PATCH', '/tasks/' + taskId, {
+            name: form.elements['name'].value,
+            description: form.elements['description'].value,
+            date: form.elements['date'].value || null,
+            habit_id: form.elements['habit_id'].value || null
+        }).then(function(data) {
+            data.habits.forEach(updateHabitRemaining);
+            const url = new URL(window.location.href);
+            url.searchParams.delete('edit');
+            if (data.task.date !== originalDate) {
+                window.location.href = url.toString();
+                return;
+            }
+            document.querySelectorAll('.toggle-task-form[data-task-id="' + taskId + '"]').forEach(function(toggleForm) {
+                toggleForm.closest('.task-item').querySelector('.task-name').textContent = data.task.name;
+            });
+            window.history.replaceState(null, '', url.toString());
+            taskIdInput.remove();
+            ['name', 'description', 'date', 'habit_id'].forEach(function(field) {
+                form.elements[field].value = '';
+            });
+        }).catch(function(error) {
+            if (error && error.errors) {
+                alert(Object.values(error.errors).join('\n'));
+            } else {
+                reportError(error);
+            }
+        });
+    });
+});
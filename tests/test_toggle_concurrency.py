@@ -0,0 +1,106 @@
+# tests/test_toggle_concurrency.py
+
+"""Concurrent toggles of one task must leave its habit's counters exact.
+
+Needs a Postgres database to write to:
+
+    DATABASE_URL=postgresql://localhost/planify_test python -m pytest tests
+"""
+
+import os
+import threading
+import uuid
+from datetime import date
+
+import pytest
+
+if not os.environ.get('DATABASE_URL'):
+    pytest.skip('DATABASE_URL is not set', allow_module_level=True)
+
+import schema
+from app import app, toggle_task_status
+from db import ConnectionPool
+
+# An odd number of toggles in total, so the task ends up completed and a
+# lost decrement can't hide behind the counters' floor of zero
+THREADS = 15
+TOGGLES_PER_THREAD = 51
+
+
+@pytest.fixture
+def pool():
+    dsn = app.config['DATABASE_URL']
+    schema.migrate(dsn)
+    pool = ConnectionPool(dsn, maxconn=THREADS + 1)
+    yield pool
+    pool.closeall()
+
+
+@pytest.fixture
+def task(pool):
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("INSERT INTO users (username, password) VALUES (%s, 'x') RETURNING id",
+                           ('toggle_test_' + uuid.uuid4().hex[:12],))
+            user_id = cursor.fetchone()['id']
+            cursor.execute('''
+                INSERT INTO habits (user_id, name, frequency, period, times_completed)
+                VALUES (%s, 'Toggle test', 1, 'day', 0) RETURNING id
+            ''', (user_id,))
+            habit_id = cursor.fetchone()['id']
+            cursor.execute('''
+                INSERT INTO tasks (user_id, habit_id, name, date, completed)
+                VALUES (%s, %s, 'Toggle test', %s, FALSE) RETURNING id
+            ''', (user_id, habit_id, date.today()))
+            task_id = cursor.fetchone()['id']
+        conn.commit()
+        yield {'id': task_id, 'user_id': user_id, 'habit_id': habit_id}
+        with conn.cursor() as cursor:
+            cursor.execute('DELETE FROM tasks WHERE user_id = %s', (user_id,))
+            cursor.execute('DELETE FROM habits WHERE user_id = %s', (user_id,))
+            cursor.execute('DELETE FROM users WHERE id = %s', (user_id,))
+        conn.commit()
+    finally:
+        pool.putconn(conn)
+
+
+def test_concurrent_toggles_keep_counters_exact(pool, task):
+    start = threading.Barrier(THREADS)
+    errors = []
+
+    def hammer():
+        conn = pool.getconn()
+        try:
+            start.wait()
+            for _ in range(TOGGLES_PER_THREAD):
+                toggle_task_status(conn, task['id'], task['user_id'])
+        except Exception as e:
+            errors.append(e)
+        finally:
+            pool.putconn(conn)
+
+    threads = [threading.Thread(target=hammer) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT completed FROM tasks WHERE id = %s', (task['id'],))
+            completed = cursor.fetchone()['completed']
+            cursor.execute('SELECT times_completed FROM habits WHERE id = %s', (task['habit_id'],))
+            times_completed = cursor.fetchone()['times_completed']
+            cursor.execute('SELECT COALESCE(sum(completed), 0) AS n FROM habit_completions WHERE habit_id = %s',
+                           (task['habit_id'],))
+            bucketed = cursor.fetchone()['n']
+        conn.rollback()
+    finally:
+        pool.putconn(conn)
+
+    assert completed is True
+    assert times_completed == 1
+    assert bucketed == 1
@@ -0,0 +1,179 @@
+# transfer.py
+
+import codecs
+import csv
+import io
+import json
+import queue
+import threading
+
+from psycopg2.extensions import QueryCanceledError
+
+FORMATS = ('csv', 'ndjson')
+
+# COPY ... TO STDOUT writes one row per write() call; ship them in chunks
+CHUNK_SIZE = 64 * 1024
+# Chunks an export may buffer ahead of a slow reader
+MAX_PENDING_CHUNKS = 16
+
+
+def copy_out_sql(cursor, query, params, fmt):
+    """COPY statement that writes the rows of ``query`` as CSV or NDJSON.
+
+    COPY takes no parameters, so they are bound client-side. NDJSON uses
+    CSV mode with quote and delimiter bytes that JSON always escapes, so
+    each row_to_json() value comes out verbatim, one per line.
+    """
+    query = cursor.mogrify(query, params).decode()
+    if fmt == 'csv':
+        return 'COPY (%s) TO STDOUT WITH (FORMAT csv, HEADER)' % query
+    if fmt == 'ndjson':
+        return ("COPY (SELECT row_to_json(r) FROM (%s) r) TO STDOUT "
+                "WITH (FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')" % query)
+    raise ValueError('Unknown format %r' % fmt)
+
+
+def copy_out(conn, query, params, fmt, out):
+    """Write the rows of ``query`` to the binary file ``out``; returns the row count."""
+    with conn.cursor() as cursor:
+        cursor.copy_expert(copy_out_sql(cursor, query, params, fmt), out)
+        return cursor.rowcount
+
+
+class _ChunkWriter:
+    """File-like sink for copy_expert that hands CHUNK_SIZE pieces to a queue."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.parts = []
+        self.length = 0
+        self.cancelled = False
+
+    def write(self, data):
+        if self.cancelled:
+            return
+        self.parts.append(data)
+        self.length += len(data)
+        if self.length >= CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.parts and not self.cancelled:
+            self.chunks.put(b''.join(self.parts))
+        self.parts, self.length = [], 0
+
+
+def stream_copy_out(conn, query, params, fmt):
+    """Yield the output of copy_out() in chunks, with bounded memory.
+
+    COPY runs on a helper thread that blocks once MAX_PENDING_CHUNKS are
+    waiting, so a slow client slows the export instead of buffering it. If
+    the client goes away the query is cancelled and the transaction rolled
+    back before the connection is handed back.
+    """
+    chunks = queue.Queue(MAX_PENDING_CHUNKS)
+    writer = _ChunkWriter(chunks)
+    done = object()
+    failure = []
+
+    def run():
+        try:
+            copy_out(conn, query, params, fmt, writer)
+            writer.flush()
+        except QueryCanceledError:
+            pass
+        except Exception as e:
+            failure.append(e)
+        finally:
+            chunks.put(done)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    finished = False
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is done:
+                finished = True
+                break
+            yield chunk
+    finally:
+        if not finished:
+            writer.cancelled = True
+            conn.cancel()
+            # Unblock the writer if it is waiting on a full queue
+            while chunks.get() is not done:
+                pass
+            conn.rollback()
+        thread.join()
+    if failure:
+        raise failure[0]
+
+
+def read_rows(f, fmt):
+    """Yield (line number, dict) for each row of a binary CSV or NDJSON file.
+
+    Rows that aren't JSON objects come through as None; a file that can't be
+    parsed at all raises ValueError.
+    """
+    text = codecs.getreader('utf-8')(f)
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        try:
+            for row in reader:
+                yield reader.line_num, row
+        except csv.Error as e:
+            raise ValueError('line %d: %s' % (reader.line_num, e))
+    elif fmt == 'ndjson':
+        for line_num, line in enumerate(text, 1):
+            if line.strip():
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                yield line_num, row if isinstance(row, dict) else None
+    else:
+        raise ValueError('Unknown format %r' % fmt)
+
+
+def _copy_text(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def copy_in(conn, table, columns, rows):
+    """Bulk insert ``rows`` (tuples matching ``columns``) with COPY ... FROM STDIN."""
+    buf = io.StringIO()
+    for row in rows:
+        buf.write('\t'.join(_copy_text(value) for value in row))
+        buf.write('\n')
+    buf.seek(0)
+    with conn.cursor() as cursor:
+        cursor.copy_expert('COPY %s (%s) FROM STDIN' % (table, ', '.join(columns)), buf)
+        return cursor.rowcount
+
+
+def format_for(filename, default=None):
+    """Guess csv/ndjson from a file name's extension."""
+    name = (filename or '').lower()
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    return default
+
+
+def batched(iterable, size):
+    """Yield lists of up to ``size`` items."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch